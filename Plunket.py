@@ -1,83 +1,1893 @@
+import time
 import sys
+
+class StartupProfiler:
+    """Monotonic timestamps for each launch phase.
+    
+    Marks are always recorded (they are a perf_counter read each).
+    --profile-startup prints the breakdown once the event loop first goes
+    idle and exits; --profile-startup-dump=PATH also writes cProfile stats,
+    and --profile-startup-imports re-runs under -X importtime.
+    """
+    
+    def __init__(self, argv):
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.phases = []
+        self.enabled = any(arg.startswith("--profile-startup") for arg in argv)
+        self.dump_path = next((arg.split("=", 1)[1] for arg in argv if arg.startswith("--profile-startup-dump=")), None)
+        self.profile = None
+        if "--profile-startup-imports" in argv and "importtime" not in sys._xoptions:
+            os.execv(sys.executable, [sys.executable, "-X", "importtime"] + argv)
+        if self.dump_path:
+            import cProfile
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+            
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, (now - self.last) * 1000))
+        self.last = now
+        
+    def elapsed(self):
+        return (self.last - self.start) * 1000
+        
+    def interpreter_startup(self):
+        """Milliseconds between process creation and the first line of this script, if psutil can tell"""
+        try:
+            import psutil as process_info
+        except ImportError:
+            return None
+        created = process_info.Process().create_time()
+        return max((time.time() - (time.perf_counter() - self.start)) - created, 0.0) * 1000
+        
+    def report(self):
+        lines = ["Startup phases (ms):"]
+        total = 0.0
+        before = self.interpreter_startup()
+        if before is not None:
+            total += before
+            lines.append(f"  {'interpreter start':<24}{before:>9.1f}{total:>10.1f}")
+        for phase, duration in self.phases:
+            total += duration
+            lines.append(f"  {phase:<24}{duration:>9.1f}{total:>10.1f}")
+        print("\n".join(lines))
+        if self.profile is not None:
+            self.profile.disable()
+            self.profile.dump_stats(self.dump_path)
+            print(f"cProfile stats written to {self.dump_path}")
+
+import os
 import subprocess
 import importlib.util
-import webbrowser
+
+STARTUP = StartupProfiler(sys.argv)
+
+DEPENDENCIES = [("requests", "requests"), ("PyQt5", "PyQt5")]
+DEPENDENCY_MARKER = os.path.join(os.path.expanduser("~"), ".plunket", "deps-verified")
+
+def install_if_missing(package, import_name):
+    spec = importlib.util.find_spec(import_name)
+    if spec is None:
+        print(f"Installing {package}...", file=sys.stderr)
+        subprocess.check_call([sys.executable, "-m", "pip", "install", package, "-q"], stdout=sys.stderr)
+        print(f"{package} installed successfully!", file=sys.stderr)
 
 def install_and_import(package, import_name=None):
     """Install package if not available and import it"""
     if import_name is None:
         import_name = package
     
-    spec = importlib.util.find_spec(import_name)
-    if spec is None:
-        print(f"Installing {package}...")
-        subprocess.check_call([sys.executable, "-m", "pip", "install", package, "-q"])
-        print(f"{package} installed successfully!")
+    install_if_missing(package, import_name)
     return importlib.import_module(import_name)
 
-print("Checking dependencies...")
-install_and_import("requests")
-install_and_import("PyQt5")
-print("All dependencies ready!\n")
+def ensure_dependencies(dependencies=DEPENDENCIES, force=False):
+    """Install missing dependencies, skipping the probe when the marker says this interpreter already has them"""
+    header = f"{sys.executable}\n{sys.version}\n"
+    names = {name for name, _ in dependencies}
+    verified = set()
+    if not force:
+        try:
+            with open(DEPENDENCY_MARKER, encoding="utf-8") as f:
+                marker = f.read()
+            if marker.startswith(header):
+                verified = set(marker[len(header):].split())
+                if names <= verified:
+                    return
+        except OSError:
+            pass
+    
+    print("Checking dependencies...", file=sys.stderr)
+    for package, import_name in dependencies:
+        install_if_missing(package, import_name)
+    try:
+        os.makedirs(os.path.dirname(DEPENDENCY_MARKER), exist_ok=True)
+        with open(DEPENDENCY_MARKER, "w", encoding="utf-8") as f:
+            f.write(header + " ".join(sorted(names | verified)) + "\n")
+    except OSError:
+        pass
+    print("All dependencies ready!\n", file=sys.stderr)
+
+class LazyModule:
+    """Stand-in for a module that is imported, and installed if missing, on first attribute access"""
+    
+    def __init__(self, package, import_name=None):
+        self._package = package
+        self._import_name = import_name or package
+        self._module = None
+        
+    def __getattr__(self, name):
+        if self._module is None:
+            self._module = install_and_import(self._package, self._import_name)
+        return getattr(self._module, name)
+
+ensure_dependencies()
+STARTUP.mark("dependency check")
+try:
+    import PyQt5.QtWidgets
+except ImportError:
+    ensure_dependencies(force=True)
+STARTUP.mark("Qt import")
 
 import random
-import requests
+import json
+import html
+import re
+import queue
+import threading
+import zlib
+import hashlib
+import sqlite3
+import string
+import bisect
+import traceback
+import argparse
+import http.server
+import urllib.parse
+from collections import deque, OrderedDict
+from email.utils import parsedate_to_datetime
 from PyQt5.QtWidgets import (QApplication, QWidget, QLabel, QVBoxLayout, 
                               QLineEdit, QTextBrowser, QHBoxLayout, QPushButton)
 from PyQt5.QtCore import Qt, QTimer, QPoint, QThread, pyqtSignal
-from PyQt5.QtGui import QFont
+from PyQt5.QtGui import QFont, QTextCursor, QTextCharFormat, QTextBlockFormat, QTextDocument
+
+requests = LazyModule("requests")
+STARTUP.mark("imports")
+
+CONFIG_DIR = os.path.join(os.path.expanduser("~"), ".plunket")
+CONFIG_PATH = os.path.join(CONFIG_DIR, "config.json")
+DEFAULT_CONFIG = {
+    "scrollback_limit": 300,
+    "scrollback_page": 50,
+    "context_budget": 3000,
+    "cache_enabled": True,
+    "cache_ttl": 86400,
+    "cache_memory_entries": 128,
+    "cache_disk_entries": 5000,
+    "history_enabled": True,
+    "retry_attempts": 5,
+    "retry_max_delay": 30,
+    "theme": "light",
+    "stall_threshold_ms": 250,
+    "stall_log": True,
+    "backend": "openai",
+    "backends": {
+        "openai": {"base_url": "https://api.openai.com/v1", "model": "gpt-4o-mini"},
+        "local": {"base_url": "http://127.0.0.1:8080/v1", "model": "local", "api_key": "",
+                  "connect_timeout": 2, "read_timeout": 120},
+    },
+    "routing": False,
+    "route_backends": [],
+    "hedging": False,
+    "hedge_backend": None,
+    "hedge_percentile": 95,
+    "hedge_min_delay": 0.25,
+    "hedge_max_delay": 5.0,
+}
+
+def load_config():
+    """Read ~/.plunket/config.json on top of the defaults"""
+    config = dict(DEFAULT_CONFIG)
+    try:
+        with open(CONFIG_PATH, encoding="utf-8") as f:
+            config.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+    if config["backends"] is not DEFAULT_CONFIG["backends"]:
+        config["backends"] = dict(DEFAULT_CONFIG["backends"], **config["backends"])
+    return config
+
+class ConnectionStats:
+    """Per-turn latency samples split by whether the connection was reused"""
+    
+    def __init__(self, limit=200):
+        self.limit = limit
+        self.cold = []
+        self.warm = []
+        
+    def record(self, seconds, reused):
+        samples = self.warm if reused else self.cold
+        samples.append(seconds)
+        if len(samples) > self.limit:
+            del samples[0]
+            
+    def summary(self):
+        if not self.cold and not self.warm:
+            return "No requests measured yet."
+        cold = sum(self.cold) / len(self.cold) * 1000 if self.cold else None
+        warm = sum(self.warm) / len(self.warm) * 1000 if self.warm else None
+        parts = []
+        if cold is not None:
+            parts.append(f"new connection avg {cold:.0f} ms over {len(self.cold)} turns")
+        if warm is not None:
+            parts.append(f"reused connection avg {warm:.0f} ms over {len(self.warm)} turns")
+        text = "Time to response headers: " + ", ".join(parts) + "."
+        if cold is not None and warm is not None:
+            saved = round(cold - warm)
+            text += f" Keep-alive saves ~{saved} ms per turn." if saved >= 1 else " No measurable saving from keep-alive."
+        return text
+
+class RateLimiter:
+    """Client-side token buckets for requests and tokens.
+    
+    Bucket sizes and refill rates are learned from the x-ratelimit-*
+    headers on every response, so the client slows down before the
+    server starts answering 429.
+    """
+    
+    KINDS = ("requests", "tokens")
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        
+    @staticmethod
+    def parse_duration(text):
+        """Seconds in a reset header such as '1s', '6m0s' or '20ms'"""
+        units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+        return sum(float(value) * units[unit] for value, unit in re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", text or ""))
+        
+    def update(self, headers):
+        now = time.monotonic()
+        with self.lock:
+            for kind in self.KINDS:
+                try:
+                    capacity = float(headers[f"x-ratelimit-limit-{kind}"])
+                    level = float(headers[f"x-ratelimit-remaining-{kind}"])
+                except (KeyError, ValueError):
+                    continue
+                reset = self.parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+                rate = (capacity - level) / reset if reset > 0 else capacity / 60
+                self.buckets[kind] = [capacity, level, max(rate, capacity / 3600), now]
+                
+    def reserve(self, tokens):
+        """Take one request and `tokens` tokens; return 0, or the seconds to wait before trying again"""
+        now = time.monotonic()
+        costs = {"requests": 1, "tokens": tokens}
+        with self.lock:
+            wait = 0.0
+            for kind, bucket in self.buckets.items():
+                capacity, level, rate, updated = bucket
+                bucket[1] = level = min(capacity, level + (now - updated) * rate)
+                bucket[3] = now
+                cost = min(costs[kind], capacity)
+                if level < cost:
+                    wait = max(wait, (cost - level) / rate)
+            if wait == 0:
+                for kind, bucket in self.buckets.items():
+                    bucket[1] -= min(costs[kind], bucket[0])
+            return wait
+
+class Backend:
+    """An OpenAI-compatible chat completions endpoint, e.g. OpenAI or a local llama.cpp/vLLM server.
+    
+    `api_key` None means the key pasted into the chat is sent; an empty
+    string sends no Authorization header, which local servers accept.
+    """
+    
+    SETTINGS = {
+        "base_url": "https://api.openai.com/v1",
+        "model": "gpt-4o-mini",
+        "api_key": None,
+        "connect_timeout": 10,
+        "read_timeout": 30,
+        "max_tokens": 1000,
+        "temperature": 0.7,
+        "context_tokens": None,
+    }
+    
+    def __init__(self, name, settings=None):
+        settings = dict(self.SETTINGS, **(settings or {}))
+        self.name = name
+        self.base_url = settings["base_url"].rstrip("/")
+        self.url = f"{self.base_url}/chat/completions"
+        self.model = settings["model"]
+        self.api_key = settings["api_key"]
+        self.timeout = (settings["connect_timeout"], settings["read_timeout"])
+        self.parameters = {"max_tokens": settings["max_tokens"], "temperature": settings["temperature"]}
+        self.context_tokens = settings["context_tokens"]
+        
+    def headers(self, api_key):
+        headers = {"Content-Type": "application/json"}
+        key = api_key if self.api_key is None else self.api_key
+        if key:
+            headers["Authorization"] = f"Bearer {key}"
+        return headers
+        
+    def describe(self):
+        key = "chat key" if self.api_key is None else ("no key" if not self.api_key else "own key")
+        return (f"{html.escape(self.name)}: {html.escape(self.model)} at {html.escape(self.base_url)} "
+                f"({key}, timeouts {self.timeout[0]}s/{self.timeout[1]}s)")
+
+class LatencyStats:
+    """Time to first token per backend and model, kept across sessions.
+    
+    Each backend keeps its last SAMPLES (prompt tokens, seconds) pairs in
+    latency.json. Percentiles set the hedge delay; a least-squares line
+    through the pairs predicts how first-token time grows with prompt size,
+    which is what the Router ranks backends by. Timeouts, 5xx answers and
+    connection failures count as taking the backend's whole read timeout.
+    A backend that could not be reached at all is also remembered as
+    unreachable for UNREACHABLE_SECONDS (not persisted).
+    """
+    
+    SAMPLES = 100
+    MIN_SAMPLES = 5
+    UNREACHABLE_SECONDS = 60
+    
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.unreachable = {}
+        self.dirty = False
+        if path is not None:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    for key, pairs in json.load(f).items():
+                        self.samples[key] = deque((tuple(pair) for pair in pairs), maxlen=self.SAMPLES)
+            except (OSError, ValueError, TypeError, AttributeError):
+                self.samples.clear()
+        
+    @staticmethod
+    def key(backend):
+        return f"{backend.base_url} {backend.model}"
+        
+    @staticmethod
+    def prompt_tokens(messages):
+        return sum(len(m["content"]) for m in messages) // 4
+        
+    def record(self, backend, prompt_tokens, seconds):
+        with self.lock:
+            self.samples.setdefault(self.key(backend), deque(maxlen=self.SAMPLES)).append((prompt_tokens, round(seconds, 4)))
+            self.dirty = True
+        
+    def mark_unreachable(self, backend):
+        self.unreachable[self.key(backend)] = time.monotonic()
+        
+    def reachable(self, backend):
+        failed = self.unreachable.get(self.key(backend))
+        return failed is None or time.monotonic() - failed >= self.UNREACHABLE_SECONDS
+        
+    def pairs(self, backend):
+        with self.lock:
+            return list(self.samples.get(self.key(backend), ()))
+        
+    def percentile(self, backend, q):
+        """The q-th percentile of first-token seconds, or None below MIN_SAMPLES"""
+        values = sorted(seconds for _, seconds in self.pairs(backend))
+        if len(values) < self.MIN_SAMPLES:
+            return None
+        return values[min(int(len(values) * q / 100), len(values) - 1)]
+        
+    def predict(self, backend, prompt_tokens):
+        """Expected first-token seconds for a prompt of `prompt_tokens`, or None below MIN_SAMPLES"""
+        pairs = self.pairs(backend)
+        if len(pairs) < self.MIN_SAMPLES:
+            return None
+        mean_x = sum(x for x, _ in pairs) / len(pairs)
+        mean_y = sum(y for _, y in pairs) / len(pairs)
+        spread = sum((x - mean_x) ** 2 for x, _ in pairs)
+        slope = max(sum((x - mean_x) * (y - mean_y) for x, y in pairs) / spread, 0.0) if spread else 0.0
+        return max(mean_y + slope * (prompt_tokens - mean_x), 0.0)
+        
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            if not self.dirty:
+                return
+            data = {key: list(pairs) for key, pairs in self.samples.items()}
+            self.dirty = False
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError:
+            pass
+
+class Router:
+    """Orders backends by predicted time to first token for a given prompt size.
+    
+    Backends whose context_tokens the prompt (plus the reply) would not fit
+    are dropped, and backends without enough samples yet come first so
+    every candidate gets measured. Backends that recently could not be
+    reached go last.
+    """
+    
+    def __init__(self, stats):
+        self.stats = stats
+        
+    def rank(self, backends, prompt_tokens):
+        fitting = [backend for backend in backends if backend.context_tokens is None
+                   or prompt_tokens + backend.parameters["max_tokens"] <= backend.context_tokens]
+        
+        def cost(backend):
+            predicted = self.stats.predict(backend, prompt_tokens)
+            return (not self.stats.reachable(backend), predicted is not None, predicted or 0.0)
+        
+        return sorted(fitting, key=cost)
 
 class OpenAIThread(QThread):
-    """Thread for handling OpenAI API calls"""
-    response_ready = pyqtSignal(str)
-    error_occurred = pyqtSignal(str)
+    """Long-lived worker that serves API calls over a pooled keep-alive session.
+    
+    Jobs are numbered by submit() and every signal carries the job id, so
+    the UI can drop output from a job it has already cancelled. Each job
+    names its Backend, so switching backends never disturbs a reply in
+    flight; rate limits are tracked per backend.
     
-    def __init__(self, api_key, message, conversation_history):
+    A job may also name a hedge backend. If the first request has not
+    produced a token within the hedge delay, or fails, the same request
+    goes to the hedge backend; whichever streams a token first wins and
+    the other request is closed. Requests run as attempts (job id, 0/1).
+    Fallback backends are tried in turn, without retries, when a backend
+    cannot be reached. answered_by names the backend whose reply is used.
+    """
+    token_received = pyqtSignal(int, str)
+    response_ready = pyqtSignal(int, str)
+    error_occurred = pyqtSignal(int, str)
+    usage_reported = pyqtSignal(int, int)
+    answered_by = pyqtSignal(int, str)
+    
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    
+    def __init__(self, stream=True, retry_attempts=5, retry_max_delay=30, latency=None):
         super().__init__()
-        self.api_key = api_key
-        self.message = message
-        self.conversation_history = conversation_history
+        self.stream = stream
+        self.retry_attempts = max(retry_attempts, 1)
+        self.retry_max_delay = retry_max_delay
+        self.jobs = queue.Queue()
+        self.session = None
+        self.stats = ConnectionStats()
+        self.limiters = {}
+        self.wake = threading.Event()
+        self.next_job = 0
+        self.current_job = None
+        self.responses = {}
+        self.posting = {}
+        self.cancelled = set()
+        self.latency = latency if latency is not None else LatencyStats()
+        self.hedges = 0
+        self.hedges_won = 0
+        
+    def submit(self, backend, api_key, message, conversation_history, hedge=None, hedge_delay=0.0, fallbacks=()):
+        self.next_job += 1
+        self.jobs.put((self.next_job, backend, api_key, message, list(conversation_history), hedge, hedge_delay,
+                       list(fallbacks)))
+        if not self.isRunning():
+            self.start()
+        return self.next_job
+        
+    def cancel(self, job_id):
+        """Abort `job_id` (or a single attempt of it), closing the HTTP responses being read"""
+        self.cancelled.add(job_id)
+        if not isinstance(job_id, tuple):
+            self.wake.set()
+        for attempt, response in list(self.responses.items()):
+            if job_id in (attempt, attempt[0]):
+                response.close()
+        for attempt, done in list(self.posting.items()):
+            if job_id in (attempt, attempt[0]):
+                done.set()
+        
+    def is_cancelled(self, attempt):
+        return attempt in self.cancelled or attempt[0] in self.cancelled
+            
+    def stop(self):
+        if self.isRunning():
+            if self.current_job is not None:
+                self.cancel(self.current_job)
+            self.jobs.put(None)
+            self.wait(2000)
         
     def run(self):
+        self.session = requests.Session()
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            if job[0] in self.cancelled:
+                self.cancelled.discard(job[0])
+                continue
+            self.current_job = job[0]
+            self.wake.clear()
+            self.process(*job)
+            self.latency.save()
+            self.current_job = None
+            self.cancelled.discard(job[0])
+        self.session.close()
+        
+    def open_connections(self, url):
+        """Connections opened so far by the session's pools for the host of `url`"""
+        host = urllib.parse.urlsplit(url).hostname
+        pools = self.session.get_adapter(url).poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys() if key.key_host == host)
+        
+    def process(self, job_id, backend, api_key, message, conversation_history, hedge=None, hedge_delay=0.0,
+                fallbacks=()):
+        messages = conversation_history + [
+            {"role": "user", "content": message}
+        ]
+        backends = [backend] + list(fallbacks)
+        if hedge is None:
+            outcome = self.attempt((job_id, 0), backends, api_key, messages, lambda attempt: True)
+        else:
+            outcome = self.hedged(job_id, backends, hedge, hedge_delay, api_key, messages)
+        if job_id in self.cancelled or outcome is None:
+            return
+        if isinstance(outcome, str):
+            self.error_occurred.emit(job_id, outcome)
+            return
+        reply, usage = outcome
+        if usage:
+            prompt_chars = sum(len(m["content"]) for m in messages)
+            self.usage_reported.emit(prompt_chars, usage.get("prompt_tokens", 0))
+        self.response_ready.emit(job_id, reply)
+        
+    def attempt(self, attempt, backends, api_key, messages, claim, retry_unreachable=True):
+        """One request of a job: (reply, usage), an error message, or None if it was cancelled or lost.
+        
+        Backends after the first are fallbacks, used without retrying when
+        the one before cannot be reached; without `retry_unreachable` the
+        last one is not retried either. `claim(attempt)` is asked before the
+        first token is passed on and returns False once another attempt won.
+        """
+        for backend in backends:
+            last = backend is backends[-1]
+            outcome = self.request(attempt, backend, api_key, messages, claim, retry_unreachable and last)
+            if last or not isinstance(outcome, str) or self.latency.reachable(backend):
+                return outcome
+        
+    def request(self, attempt, backend, api_key, messages, claim, retry_unreachable):
+        """attempt() on a single backend"""
+        started = time.monotonic()
+        prompt_tokens = LatencyStats.prompt_tokens(messages)
+        first = []
+        
+        def first_token():
+            first.append(True)
+            self.latency.record(backend, prompt_tokens, time.monotonic() - started)
+            if not claim(attempt):
+                return False
+            self.answered_by.emit(attempt[0], backend.name)
+            return True
+        
         try:
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
+            data = dict(backend.parameters, model=backend.model, messages=messages, stream=self.stream)
+            if self.stream:
+                data["stream_options"] = {"include_usage": True}
+            
+            response = self.send(attempt, backend, backend.headers(api_key), data, retry_unreachable)
+            if response is None:
+                return None
+            
+            if response.status_code != 200:
+                response.close()
+                if response.status_code >= 500:
+                    self.latency.record(backend, prompt_tokens, backend.timeout[1])
+                return f"API Error: {response.status_code}"
+            if self.stream:
+                return self.read_stream(attempt, response, first_token)
+            result = response.json()
+            if not first_token():
+                return None
+            return result['choices'][0]['message']['content'], result.get('usage')
+        
+        except Exception as e:
+            if self.is_cancelled(attempt):
+                return None
+            if isinstance(e, (requests.ConnectionError, requests.Timeout)):
+                self.latency.record(backend, prompt_tokens, backend.timeout[1])
+                if isinstance(e, requests.ConnectionError) and not first:
+                    self.latency.mark_unreachable(backend)
+            return f"Error: {str(e)}"
+        finally:
+            if not first and attempt in self.cancelled and attempt[0] not in self.cancelled:
+                # A hedge loser: it had waited at least this long without a token
+                self.latency.record(backend, prompt_tokens, time.monotonic() - started)
+            self.responses.pop(attempt, None)
+            self.cancelled.discard(attempt)
+        
+    def hedged(self, job_id, backends, hedge, delay, api_key, messages):
+        """Run the job on `backends`, adding `hedge` after `delay` seconds without a token or on failure"""
+        attempts = [(job_id, 0), (job_id, 1)]
+        outcomes = {}
+        winner = []
+        lock = threading.Lock()
+        changed = threading.Event()
+        
+        def claim(attempt):
+            with lock:
+                if not winner:
+                    winner.append(attempt)
+                    for other in attempts:
+                        if other != attempt:
+                            self.cancel(other)
+            changed.set()
+            return winner[0] == attempt
+        
+        def run(attempt, targets, retry_unreachable):
+            outcomes[attempt] = self.attempt(attempt, targets, api_key, messages, claim, retry_unreachable)
+            changed.set()
+        
+        threads = [threading.Thread(target=run, args=(attempts[0], backends, False), daemon=True)]
+        threads[0].start()
+        deadline = time.monotonic() + delay
+        while not winner and attempts[0] not in outcomes and job_id not in self.cancelled:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            changed.wait(remaining)
+            changed.clear()
+        if not winner and job_id not in self.cancelled and not isinstance(outcomes.get(attempts[0], ""), tuple):
+            self.hedges += 1
+            threads.append(threading.Thread(target=run, args=(attempts[1], [hedge], True), daemon=True))
+            threads[1].start()
+        
+        while not winner and any(thread.is_alive() for thread in threads) and job_id not in self.cancelled:
+            changed.wait(0.5)
+            changed.clear()
+        if winner:
+            threads[attempts.index(winner[0])].join()
+            if winner[0] == attempts[1]:
+                self.hedges_won += 1
+            return outcomes.get(winner[0])
+        for thread in threads:
+            thread.join()
+        return next((outcomes[attempt] for attempt in attempts if outcomes.get(attempt) is not None), None)
+        
+    def send(self, attempt, backend, headers, data, retry_unreachable=True):
+        """POST with client-side rate limiting and jittered exponential backoff.
+        
+        429, 5xx and connection failures are retried until the retry budget
+        is spent; the last response or exception is then passed on. Without
+        `retry_unreachable`, a failure to connect is passed on at once.
+        Returns None if the job was cancelled meanwhile.
+        """
+        tokens = len(json.dumps(data["messages"])) // 4 + data.get("max_tokens", 0)
+        limiter = self.limiters.setdefault(backend.name, RateLimiter())
+        tries = 0
+        while True:
+            delay = limiter.reserve(tokens)
+            if delay > 0:
+                if self.pause(attempt, min(delay, self.retry_max_delay)):
+                    return None
+                continue
             
-            messages = self.conversation_history + [
-                {"role": "user", "content": self.message}
-            ]
+            tries += 1
+            last_attempt = tries >= self.retry_attempts
+            try:
+                connections = self.open_connections(backend.url)
+                response = self.post(attempt, backend, headers, data)
+                if response is None:
+                    return None
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if last_attempt or self.is_cancelled(attempt) or (
+                        not retry_unreachable and isinstance(e, requests.ConnectionError)):
+                    raise
+                if self.pause(attempt, self.backoff(tries)):
+                    return None
+                continue
             
-            data = {
-                "model": "gpt-4o-mini",
-                "messages": messages,
-                "max_tokens": 1000,
-                "temperature": 0.7
-            }
+            self.responses[attempt] = response
+            if response.status_code not in self.RETRY_STATUSES:
+                self.stats.record(response.elapsed.total_seconds(), self.open_connections(backend.url) == connections)
+            limiter.update(response.headers)
+            if self.is_cancelled(attempt):
+                response.close()
+                return None
+            if response.status_code not in self.RETRY_STATUSES or last_attempt:
+                return response
             
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers=headers,
-                json=data,
-                timeout=30
+            delay = self.retry_after(response.headers)
+            response.close()
+            if self.pause(attempt, delay if delay is not None else self.backoff(tries)):
+                return None
+            
+    def post(self, attempt, backend, headers, data):
+        """session.post on a helper thread, so cancelling `attempt` frees the worker before the headers arrive.
+        
+        Returns None if the attempt was cancelled first; the abandoned
+        request closes its response whenever the server gets round to it.
+        """
+        outcome = []
+        state = {"abandoned": False}
+        lock = threading.Lock()
+        done = threading.Event()
+        
+        def run():
+            try:
+                result = self.session.post(
+                    backend.url,
+                    headers=headers,
+                    json=data,
+                    timeout=backend.timeout,
+                    stream=self.stream
+                )
+            except Exception as e:
+                result = e
+            with lock:
+                outcome.append(result)
+                abandoned = state["abandoned"]
+            if abandoned and not isinstance(result, Exception):
+                result.close()
+            done.set()
+        
+        self.posting[attempt] = done
+        try:
+            if self.is_cancelled(attempt):
+                return None
+            threading.Thread(target=run, name="plunket-post", daemon=True).start()
+            done.wait()
+            with lock:
+                if not outcome or self.is_cancelled(attempt):
+                    state["abandoned"] = True
+                    if outcome and not isinstance(outcome[0], Exception):
+                        outcome[0].close()
+                    return None
+        finally:
+            self.posting.pop(attempt, None)
+        if isinstance(outcome[0], Exception):
+            raise outcome[0]
+        return outcome[0]
+        
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.retry_max_delay, 0.5 * 2 ** attempt))
+        
+    def retry_after(self, headers):
+        if "retry-after-ms" in headers:
+            try:
+                return min(float(headers["retry-after-ms"]) / 1000, self.retry_max_delay)
+            except ValueError:
+                pass
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            seconds = float(value)
+        except ValueError:
+            try:
+                seconds = parsedate_to_datetime(value).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        return min(max(seconds, 0.0), self.retry_max_delay)
+        
+    def pause(self, attempt, seconds):
+        """Sleep unless cancelled first; return True if the attempt was cancelled"""
+        self.wake.wait(seconds)
+        return self.is_cancelled(attempt)
+    
+    def read_stream(self, attempt, response, first_token):
+        """Parse server-sent events, emitting each content delta as it arrives; None if another attempt won"""
+        response.encoding = "utf-8"
+        parts = []
+        usage = None
+        for line in response.iter_lines(chunk_size=None, decode_unicode=True):
+            if self.is_cancelled(attempt):
+                break
+            if not line or not line.startswith("data:"):
+                continue
+            payload = line[5:].strip()
+            if payload == "[DONE]":
+                # Keep reading to EOF so the connection goes back to the pool
+                continue
+            chunk = json.loads(payload)
+            usage = chunk.get("usage") or usage
+            choices = chunk.get("choices") or []
+            if not choices:
+                continue
+            token = choices[0].get("delta", {}).get("content")
+            if token:
+                if not parts and not first_token():
+                    response.close()
+                    return None
+                parts.append(token)
+                self.token_received.emit(attempt[0], token)
+        return "".join(parts), usage
+
+class ResponseCache:
+    """Replies keyed on a hash of model, parameters and effective messages.
+    
+    Lookups go to an in-memory LRU first and then to a SQLite file. Both
+    tiers expire entries after `ttl` seconds and evict the least recently
+    used ones beyond their size limits. The key covers the whole effective
+    conversation, so a hit needs the same prompt after the same context,
+    e.g. an opening question asked again after /clear or in a later
+    session; a prompt repeated within one conversation is not a hit.
+    """
+    
+    def __init__(self, path, memory_entries=128, disk_entries=5000, ttl=86400):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.disk_entries = disk_entries
+        self.ttl = ttl
+        self.memory = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.db = None
+        
+    @staticmethod
+    def key(backend, model, parameters, messages):
+        payload = json.dumps({"backend": backend, "model": model, "parameters": parameters, "messages": messages},
+                             sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+        
+    def connect(self):
+        if self.db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.db = sqlite3.connect(self.path)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, reply TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
             )
+            self.db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        return self.db
+        
+    def get(self, key):
+        now = time.time()
+        entry = self.memory.get(key)
+        if entry is not None and now - entry[1] < self.ttl:
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+        self.memory.pop(key, None)
+        
+        db = self.connect()
+        row = db.execute("SELECT reply, created FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is not None and now - row[1] < self.ttl:
+            db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            db.commit()
+            self.remember(key, row[0], row[1])
+            self.hits += 1
+            return row[0]
+        self.misses += 1
+        return None
+        
+    def remember(self, key, reply, created):
+        self.memory[key] = (reply, created)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
             
+    def put(self, key, reply):
+        now = time.time()
+        self.remember(key, reply, now)
+        db = self.connect()
+        db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, reply, now, now))
+        db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        db.execute(
+            "DELETE FROM responses WHERE key IN "
+            "(SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.disk_entries,)
+        )
+        db.commit()
+        
+    def stats(self):
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups * 100 if lookups else 0.0
+        rows = self.connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        size = os.path.getsize(self.path) / 1024 if os.path.exists(self.path) else 0.0
+        return (f"Cache: {self.hits}/{lookups} hits ({rate:.0f}%), {len(self.memory)} in memory, "
+                f"{rows} on disk ({size:.0f} KB)")
+        
+    def clear(self):
+        self.memory.clear()
+        self.connect().execute("DELETE FROM responses")
+        self.db.commit()
+        self.db.execute("VACUUM")
+
+class ConversationStore:
+    """Append-only archive of every turn with a full-text index.
+    
+    Writes are queued to a background thread that batches them into a
+    SQLite database in WAL mode, so recording a turn never blocks the UI.
+    Searches read through their own connection and rank matches with FTS5,
+    falling back to LIKE on SQLite builds without it.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.session = time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+        self.writes = queue.Queue()
+        self.ready = threading.Event()
+        self.fts = True
+        self.reader = None
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+        
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=5)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+        
+    def write_loop(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        db = self.connect()
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS messages "
+            "(id INTEGER PRIMARY KEY, session TEXT NOT NULL, created REAL NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL)"
+        )
+        try:
+            db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(content, content='messages', content_rowid='id')")
+            db.execute(
+                "CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN "
+                "INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content); END"
+            )
+        except sqlite3.OperationalError:
+            self.fts = False
+        db.commit()
+        self.ready.set()
+        
+        while True:
+            item = self.writes.get()
+            batch = []
+            while item is not None:
+                batch.append(item)
+                try:
+                    item = self.writes.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                db.executemany("INSERT INTO messages (session, created, role, content) VALUES (?, ?, ?, ?)", batch)
+                db.commit()
+            if item is None:
+                break
+        db.close()
+        
+    def record(self, role, content):
+        self.writes.put((self.session, time.time(), role, content))
+        
+    def search(self, terms, limit=10):
+        """Return (created, role, snippet HTML) rows for the best matches across all sessions"""
+        self.ready.wait(5)
+        if self.reader is None:
+            self.reader = self.connect()
+        words = terms.split()
+        if self.fts:
+            query = " ".join('"' + word.replace('"', '""') + '"' for word in words)
+            rows = self.reader.execute(
+                "SELECT m.created, m.role, snippet(messages_fts, 0, char(2), char(3), '...', 12) "
+                "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+                "WHERE messages_fts MATCH ? ORDER BY rank LIMIT ?",
+                (query, limit)
+            ).fetchall()
+        else:
+            clause = " AND ".join("content LIKE ?" for _ in words)
+            rows = self.reader.execute(
+                f"SELECT created, role, substr(content, 1, 120) FROM messages WHERE {clause} "
+                "ORDER BY created DESC LIMIT ?",
+                [f"%{word}%" for word in words] + [limit]
+            ).fetchall()
+        return [
+            (created, role, html.escape(snippet).replace("\x02", "<b>").replace("\x03", "</b>"))
+            for created, role, snippet in rows
+        ]
+        
+    def close(self):
+        self.writes.put(None)
+        self.writer.join(2)
+        if self.reader is not None:
+            self.reader.close()
+
+class ContextManager:
+    """Packs the conversation into a token budget.
+    
+    Token counts come from a characters-per-token estimate that is
+    recalibrated against the prompt_tokens the API reports. Turns that no
+    longer fit are handed out through take_overflow() so they can be folded
+    into a rolling summary.
+    """
+    
+    MESSAGE_OVERHEAD = 4
+    
+    def __init__(self, system_prompt, budget=3000):
+        self.system_prompt = system_prompt
+        self.budget = budget
+        self.chars_per_token = 4.0
+        self.generation = 0
+        self.reset()
+        
+    def reset(self):
+        self.turns = []
+        self.summary = ""
+        self.overflow = []
+        self.generation += 1
+        
+    def count(self, text):
+        return int(len(text) / self.chars_per_token) + 1
+        
+    def message_tokens(self, message):
+        return self.count(message["content"]) + self.MESSAGE_OVERHEAD
+        
+    def calibrate(self, chars, prompt_tokens):
+        if chars <= 0 or prompt_tokens <= 0:
+            return
+        ratio = min(max(chars / prompt_tokens, 1.5), 8.0)
+        self.chars_per_token = 0.8 * self.chars_per_token + 0.2 * ratio
+        
+    def base_messages(self):
+        messages = [{"role": "system", "content": self.system_prompt}]
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the earlier conversation: {self.summary}"})
+        return messages
+        
+    def build(self, message):
+        """History to send ahead of `message`: system prompt, summary and the newest turns that fit"""
+        base = self.base_messages()
+        used = sum(self.message_tokens(m) for m in base) + self.count(message) + self.MESSAGE_OVERHEAD
+        recent = []
+        for turn in reversed(self.turns):
+            used += self.message_tokens(turn)
+            if used > self.budget:
+                break
+            recent.append(turn)
+        return base + recent[::-1]
+        
+    def add_turn(self, user_message, reply):
+        self.turns.append({"role": "user", "content": user_message})
+        self.turns.append({"role": "assistant", "content": reply})
+        total = sum(self.message_tokens(m) for m in self.turns)
+        if total <= self.budget:
+            return
+        while self.turns and total > self.budget // 2:
+            for turn in self.turns[:2]:
+                total -= self.message_tokens(turn)
+            self.overflow.extend(self.turns[:2])
+            del self.turns[:2]
+            
+    def take_overflow(self):
+        turns, self.overflow = self.overflow, []
+        return turns
+        
+    def tokens_in_use(self):
+        return sum(self.message_tokens(m) for m in self.base_messages() + self.turns)
+
+class SummaryThread(QThread):
+    """Folds old turns into the rolling conversation summary off the UI thread"""
+    summary_ready = pyqtSignal(int, str)
+    
+    def __init__(self, backend, api_key, generation, summary, turns):
+        super().__init__()
+        self.backend = backend
+        self.api_key = api_key
+        self.generation = generation
+        self.summary = summary
+        self.turns = turns
+        
+    def run(self):
+        transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in self.turns)
+        prompt = (
+            "Update the running summary of a conversation between a user and the assistant Plunket. "
+            "Keep facts, names, preferences and open questions. Reply with the summary only, under 150 words.\n\n"
+            f"Current summary:\n{self.summary or '(none)'}\n\nNew turns:\n{transcript}"
+        )
+        try:
+            response = requests.post(
+                self.backend.url,
+                headers=self.backend.headers(self.api_key),
+                json={
+                    "model": self.backend.model,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "max_tokens": 300,
+                    "temperature": 0.2
+                },
+                timeout=self.backend.timeout
+            )
             if response.status_code == 200:
-                result = response.json()
-                reply = result['choices'][0]['message']['content']
-                self.response_ready.emit(reply)
+                self.summary = response.json()['choices'][0]['message']['content'].strip()
+        except Exception:
+            pass
+        self.summary_ready.emit(self.generation, self.summary)
+
+class MarkdownRenderer:
+    """Markdown to the HTML subset QTextDocument understands.
+    
+    Text is split into blocks at blank lines outside fenced code. A block
+    is settled once a later blank line or its closing fence has arrived;
+    whatever follows is the open block, the only part of a streaming
+    reply that can still change. Settled blocks are memoised by source and
+    whole replies by text, so re-rendering is paid once per block rather
+    than once per token. Fenced code is highlighted with pygments when it
+    is installed and shown plain otherwise.
+    """
+    
+    PARAGRAPH = '<p style="margin: 4px 0;">'
+    LEAD = '<p style="margin: 8px 0;">'
+    LIST_ITEM = re.compile(r"(\s*)([-*+]|\d+[.)])\s+(.*)")
+    HEADING = re.compile(r"(#{1,6})\s+(.*?)\s*#*")
+    RULE = re.compile(r"([-*_])(\s*\1){2,}")
+    CODE_SPAN = re.compile(r"(`+)(.+?)\1")
+    LINK = re.compile(r"\[([^\]]+)\]\(((?:https?://|mailto:)[^)\s]+)\)")
+    BOLD = re.compile(r"\*\*(?=\S)(.+?)(?<=\S)\*\*|__(?=\S)(.+?)(?<=\S)__")
+    ITALIC = re.compile(r"(?<![*\w])\*(?=[^\s*])(.+?)(?<=[^\s*])\*(?!\*)|(?<!\w)_(?=[^\s_])(.+?)(?<=[^\s_])_(?!\w)")
+    STRIKE = re.compile(r"~~(?=\S)(.+?)(?<=\S)~~")
+    
+    def __init__(self, block_cache=2048, message_cache=128):
+        self.block_cache = block_cache
+        self.message_cache = message_cache
+        self.blocks = OrderedDict()
+        self.messages = OrderedDict()
+        self.formatter = None
+        
+    @staticmethod
+    def split(text):
+        """Split `text` into (settled blocks, open block); only complete lines can settle"""
+        lines = text.split("\n")
+        partial = lines.pop()
+        current = [partial] if partial else []
+        blocks = []
+        block = []
+        fence = None
+        for line in lines:
+            stripped = line.strip()
+            if fence is not None:
+                block.append(line)
+                if stripped.startswith(fence) and not stripped.strip(fence[0]):
+                    blocks.append("\n".join(block))
+                    block = []
+                    fence = None
+            elif stripped.startswith(("```", "~~~")):
+                if block:
+                    blocks.append("\n".join(block))
+                block = [line]
+                fence = stripped[:3]
+            elif stripped:
+                block.append(line)
+            elif block:
+                blocks.append("\n".join(block))
+                block = []
+        return blocks, "\n".join(block + current)
+        
+    def update(self, text, settled, final, prefix):
+        """Render what changed since the caller settled `settled` blocks.
+        
+        Returns (settled count, HTML of newly settled blocks, HTML of the
+        open block). A final update settles the open block too.
+        """
+        if final and settled == 0:
+            return self.render(text, prefix)
+        blocks, open_block = self.split(text)
+        if final and open_block.strip():
+            blocks.append(open_block)
+            open_block = ""
+        html = "".join(self.block(source, prefix if index == 0 else "")
+                       for index, source in enumerate(blocks) if index >= settled)
+        open_html = self.render_block(open_block, "" if blocks else prefix) if open_block.strip() else ""
+        return len(blocks), html, open_html
+        
+    def render(self, text, prefix):
+        """Render a whole reply, reusing the result for text seen before"""
+        key = (prefix, text)
+        result = self.messages.get(key)
+        if result is not None:
+            self.messages.move_to_end(key)
+            return result
+        blocks, open_block = self.split(text)
+        if open_block.strip():
+            blocks.append(open_block)
+        result = (len(blocks), "".join(self.block(source, prefix if index == 0 else "")
+                                       for index, source in enumerate(blocks)), "")
+        self.messages[key] = result
+        if len(self.messages) > self.message_cache:
+            self.messages.popitem(last=False)
+        return result
+        
+    def block(self, source, prefix=""):
+        key = (prefix, source)
+        html = self.blocks.get(key)
+        if html is not None:
+            self.blocks.move_to_end(key)
+            return html
+        html = self.blocks[key] = self.render_block(source, prefix)
+        if len(self.blocks) > self.block_cache:
+            self.blocks.popitem(last=False)
+        return html
+        
+    def render_block(self, source, prefix=""):
+        lines = source.strip("\n").split("\n")
+        opening = lines[0].strip()
+        if opening.startswith(("```", "~~~")):
+            body = lines[1:]
+            if body and body[-1].strip().startswith(opening[:3]) and not body[-1].strip().strip(opening[0]):
+                body.pop()
+            html = self.code("\n".join(body), opening[3:].strip())
+        else:
+            html = self.structure(lines)
+        if not prefix:
+            return html
+        if html.startswith(self.PARAGRAPH):
+            return f"{self.LEAD}{prefix} {html[len(self.PARAGRAPH):]}"
+        return f"{self.LEAD}{prefix}</p>{html}"
+        
+    def structure(self, lines):
+        out = []
+        paragraph = []
+        
+        def flush():
+            if paragraph:
+                out.append(self.PARAGRAPH + "<br>".join(self.inline(line.strip()) for line in paragraph) + "</p>")
+                paragraph.clear()
+        
+        index = 0
+        while index < len(lines):
+            line = lines[index]
+            stripped = line.strip()
+            heading = self.HEADING.fullmatch(stripped)
+            if heading:
+                flush()
+                level = len(heading.group(1))
+                out.append(f"<h{level}>{self.inline(heading.group(2))}</h{level}>")
+                index += 1
+            elif self.RULE.fullmatch(stripped):
+                flush()
+                out.append("<hr>")
+                index += 1
+            elif (stripped.startswith("|") and index + 1 < len(lines)
+                  and "-" in lines[index + 1] and not set(lines[index + 1].strip()) - set("|:- ")):
+                flush()
+                rows = [stripped]
+                index += 2
+                while index < len(lines) and lines[index].strip().startswith("|"):
+                    rows.append(lines[index].strip())
+                    index += 1
+                out.append(self.table(rows))
+            elif stripped.startswith(">"):
+                flush()
+                quoted = []
+                while index < len(lines) and lines[index].strip().startswith(">"):
+                    quoted.append(lines[index].strip()[1:])
+                    index += 1
+                out.append(f"<blockquote>{self.structure(quoted)}</blockquote>")
+            elif self.LIST_ITEM.fullmatch(line):
+                flush()
+                items = []
+                while index < len(lines) and (self.LIST_ITEM.fullmatch(lines[index])
+                                              or lines[index][:1] in (" ", "\t") and lines[index].strip()):
+                    items.append(lines[index])
+                    index += 1
+                out.append(self.list(items))
+            else:
+                paragraph.append(line)
+                index += 1
+        flush()
+        return "".join(out)
+        
+    def list(self, lines):
+        out = []
+        levels = []
+        for line in lines:
+            item = self.LIST_ITEM.fullmatch(line)
+            if item is None:
+                out.append("<br>" + self.inline(line.strip()))
+                continue
+            indent = len(item.group(1).expandtabs(4))
+            tag = "ol" if item.group(2)[0].isdigit() else "ul"
+            if not levels or indent > levels[-1][0]:
+                out.append(f"<{tag}>")
+                levels.append((indent, tag))
+            else:
+                while len(levels) > 1 and indent < levels[-1][0]:
+                    out.append(f"</li></{levels.pop()[1]}>")
+                out.append("</li>")
+            out.append("<li>" + self.inline(item.group(3)))
+        while levels:
+            out.append(f"</li></{levels.pop()[1]}>")
+        return "".join(out)
+        
+    def table(self, rows):
+        cells = [[self.inline(cell.strip()) for cell in row.strip("|").split("|")] for row in rows]
+        html = ['<table border="1" cellspacing="0" cellpadding="4" style="border-collapse: collapse;">']
+        html.append("<tr>" + "".join(f"<th>{cell}</th>" for cell in cells[0]) + "</tr>")
+        for row in cells[1:]:
+            html.append("<tr>" + "".join(f"<td>{cell}</td>" for cell in row) + "</tr>")
+        html.append("</table>")
+        return "".join(html)
+        
+    def inline(self, text):
+        out = []
+        position = 0
+        for span in self.CODE_SPAN.finditer(text):
+            out.append(self.emphasis(text[position:span.start()]))
+            out.append(f"<code>{html.escape(span.group(2).strip())}</code>")
+            position = span.end()
+        out.append(self.emphasis(text[position:]))
+        return "".join(out)
+        
+    def emphasis(self, text):
+        text = html.escape(text, quote=False)
+        text = self.LINK.sub(lambda link: f'<a href="{link.group(2).replace(chr(34), "%22")}">{link.group(1)}</a>', text)
+        text = self.BOLD.sub(lambda match: f"<b>{match.group(1) or match.group(2)}</b>", text)
+        text = self.ITALIC.sub(lambda match: f"<i>{match.group(1) or match.group(2)}</i>", text)
+        return self.STRIKE.sub(r"<s>\1</s>", text)
+        
+    def code(self, source, language):
+        if self.formatter is None:
+            try:
+                from pygments import highlight
+                from pygments.formatters import HtmlFormatter
+                from pygments.lexers import get_lexer_by_name
+                from pygments.util import ClassNotFound
+                formatter = HtmlFormatter(nowrap=True, noclasses=True)
+                self.formatter = (highlight, formatter, get_lexer_by_name, ClassNotFound)
+            except ImportError:
+                self.formatter = False
+        body = html.escape(source, quote=False)
+        if self.formatter and language:
+            highlight, formatter, get_lexer_by_name, ClassNotFound = self.formatter
+            try:
+                body = highlight(source, get_lexer_by_name(language), formatter).rstrip("\n")
+            except ClassNotFound:
+                pass
+        return f'<pre style="margin: 4px 0;">{body}</pre>'
+
+class RenderThread(QThread):
+    """Long-lived worker that renders reply Markdown off the UI thread.
+    
+    A job carries a reply's full text and how many of its blocks the
+    document already shows settled; the result holds only the HTML that
+    has to change, so a long streaming answer costs one block per update.
+    """
+    rendered = pyqtSignal(int, int, int, bool, str, str)
+    
+    def __init__(self):
+        super().__init__()
+        self.renderer = MarkdownRenderer()
+        self.jobs = queue.Queue()
+        
+    def submit(self, render_id, text, settled, final, prefix):
+        self.jobs.put((render_id, text, settled, final, prefix))
+        if not self.isRunning():
+            self.start()
+        
+    def stop(self):
+        if self.isRunning():
+            self.jobs.put(None)
+            self.wait(2000)
+        
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            render_id, text, settled, final, prefix = job
+            settled, html, open_html = self.renderer.update(text, settled, final, prefix)
+            self.rendered.emit(render_id, len(text), settled, final, html, open_html)
+
+class PendingPrompt:
+    """A user prompt waiting for, or receiving, its reply"""
+    
+    def __init__(self, text):
+        self.text = text
+        self.queued_at = time.monotonic()
+        self.started_at = None
+        self.job_id = None
+        self.key = None
+        self.reply_message = None
+        self.backend = None
+        self.messages = None
+        self.render = None
+        self.streaming = False
+
+class ReplyRender:
+    """A reply on its way through the Markdown renderer.
+    
+    `tail` is the offset inside the message where the open block starts,
+    or None once everything shown has settled; `length` is how much of
+    `text` the document shows rendered, the rest sits after it as plain text.
+    """
+    
+    def __init__(self, render_id, message, prefix, text="", final=False):
+        self.id = render_id
+        self.message = message
+        self.prefix = prefix
+        self.text = text
+        self.final = final
+        self.length = 0
+        self.settled = 0
+        self.tail = 0
+        self.busy = False
+
+class ChatMessage:
+    """Handle to the run of blocks a single message occupies in the chat document"""
+    
+    def __init__(self, first, last):
+        self.first = first
+        self.last = last
+        self.pinned = False
+
+class ChatDocument:
+    """Message-level view over the chat QTextBrowser.
+    
+    Every message keeps a handle to its first and last QTextBlock, so a
+    message can be replaced, extended or removed in place without
+    serialising the rest of the transcript. Appending keeps at most `limit`
+    messages rendered; older ones are evicted into a compressed store and
+    loaded back a page at a time when the view is scrolled to the top.
+    """
+    
+    def __init__(self, browser, limit=300, page=50):
+        self.browser = browser
+        self.document = browser.document()
+        self.document.setUndoRedoEnabled(False)
+        self.limit = max(limit, 10)
+        self.page = max(page, 1)
+        self.rendered = deque()
+        self.evicted = []
+        self.loading = False
+        browser.verticalScrollBar().valueChanged.connect(self.on_scroll)
+        
+    def append(self, html):
+        empty = self.document.isEmpty()
+        previous = self.document.lastBlock()
+        self.browser.append(html)
+        first = self.document.firstBlock() if empty else previous.next()
+        message = ChatMessage(first, self.document.lastBlock())
+        self.rendered.append(message)
+        while len(self.rendered) > self.limit and not self.rendered[0].pinned:
+            self.evict(self.rendered.popleft())
+        return message
+        
+    def select(self, message):
+        cursor = QTextCursor(self.document)
+        cursor.setPosition(message.first.position())
+        cursor.setPosition(message.last.position() + message.last.length() - 1, QTextCursor.KeepAnchor)
+        return cursor
+        
+    def replace(self, message, html):
+        cursor = self.select(message)
+        start = cursor.selectionStart()
+        cursor.insertHtml(html)
+        message.first = self.document.findBlock(start)
+        message.last = cursor.block()
+        
+    def append_text(self, message, text, char_format):
+        cursor = QTextCursor(message.last)
+        cursor.movePosition(QTextCursor.EndOfBlock)
+        cursor.insertText(text, char_format)
+        message.last = cursor.block()
+        
+    def extend(self, message, tail, text):
+        """Append plain text to the open block at `tail`, opening one if nothing is open; returns the tail"""
+        cursor = QTextCursor(message.last)
+        cursor.movePosition(QTextCursor.EndOfBlock)
+        if tail is None:
+            self.open_block(cursor)
+            tail = cursor.position() - message.first.position()
+        cursor.insertText(text, QTextCharFormat())
+        message.last = cursor.block()
+        return tail
+        
+    def replace_tail(self, message, tail, html, open_html):
+        """Swap everything from `tail` on for newly settled `html` and the open block; returns the new tail"""
+        start = message.first.position()
+        end = message.last.position() + message.last.length() - 1
+        cursor = QTextCursor(self.document)
+        cursor.beginEditBlock()
+        if tail is None:
+            cursor.setPosition(end)
+            self.open_block(cursor)
+        else:
+            cursor.setPosition(start + tail)
+            cursor.setPosition(end, QTextCursor.KeepAnchor)
+        if html:
+            self.insert_blocks(cursor, html)
+            if open_html:
+                self.open_block(cursor)
+        tail = cursor.selectionStart() - start if open_html else None
+        if open_html:
+            self.insert_blocks(cursor, open_html)
+        cursor.endEditBlock()
+        message.first = self.document.findBlock(start)
+        message.last = cursor.block()
+        return tail
+        
+    def open_block(self, cursor):
+        """Start a plain block at the cursor, reusing the empty one Qt leaves after a table"""
+        if cursor.block().length() == 1 and QTextCursor(cursor.block().previous()).currentTable() is not None:
+            cursor.setBlockFormat(QTextBlockFormat())
+        else:
+            cursor.insertBlock(QTextBlockFormat(), QTextCharFormat())
+        
+    def insert_blocks(self, cursor, html):
+        """insertHtml at a block start, keeping the first inserted block's own format.
+        
+        Qt usually merges the fragment's first block into the block under
+        the cursor, which keeps its old format and list, so a heading, code
+        line or list item arriving there is restored from a parse of `html`.
+        """
+        position = cursor.selectionStart()
+        spanned = self.document.findBlock(cursor.selectionEnd()).blockNumber() - self.document.findBlock(position).blockNumber()
+        blocks = self.document.blockCount() - spanned
+        cursor.insertHtml(html)
+        probe = QTextDocument()
+        probe.setHtml(html)
+        if self.document.blockCount() - blocks == probe.blockCount():
+            # nothing was merged (a leading rule), so the emptied block is left over
+            QTextCursor(self.document.findBlock(position)).deleteChar()
+        source = probe.firstBlock()
+        block_format = source.blockFormat()
+        block_format.setObjectIndex(-1)
+        fixer = QTextCursor(self.document.findBlock(position))
+        fixer.setBlockFormat(block_format)
+        if source.textList() is not None:
+            following = fixer.block().next()
+            if source.next().textList() == source.textList() and following.textList() is not None:
+                following.textList().add(fixer.block())
             else:
-                self.error_occurred.emit(f"API Error: {response.status_code}")
+                fixer.createList(source.textList().format())
+        
+    def remove(self, message):
+        if self.rendered and self.rendered[-1] is message:
+            self.rendered.pop()
+        else:
+            self.rendered.remove(message)
+        self.delete_blocks(message)
+        
+    def delete_blocks(self, message):
+        cursor = self.select(message)
+        if message.first.previous().isValid():
+            cursor.setPosition(message.first.position() - 1)
+            cursor.setPosition(message.last.position() + message.last.length() - 1, QTextCursor.KeepAnchor)
+        elif message.last.next().isValid():
+            cursor.setPosition(message.first.position())
+            cursor.setPosition(message.last.next().position(), QTextCursor.KeepAnchor)
+        cursor.removeSelectedText()
+        
+    def evict(self, message):
+        html = self.select(message).selection().toHtml()
+        self.evicted.append(zlib.compress(html.encode("utf-8")))
+        self.delete_blocks(message)
+        
+    def prepend(self, html):
+        """Insert `html` as a message above the others.
+        
+        Splitting the first block leaves its handle on the piece in front,
+        which becomes the new block 0, so the previous first message is
+        pointed back at its own blocks afterwards.
+        """
+        following = self.rendered[0] if self.rendered else None
+        single = following is not None and following.first == following.last
+        blocks = self.document.blockCount()
+        cursor = QTextCursor(self.document)
+        cursor.insertBlock()
+        cursor.movePosition(QTextCursor.Start)
+        cursor.insertHtml(html)
+        added = self.document.blockCount() - blocks
+        message = ChatMessage(self.document.firstBlock(), self.document.findBlockByNumber(added - 1))
+        if following is not None:
+            following.first = self.document.findBlockByNumber(added)
+            if single:
+                following.last = following.first
+        self.rendered.appendleft(message)
+        return message
+        
+    def on_scroll(self, value):
+        scrollbar = self.browser.verticalScrollBar()
+        if self.loading or not self.evicted or value > scrollbar.minimum():
+            return
+        self.loading = True
+        height = scrollbar.maximum()
+        for _ in range(min(self.page, len(self.evicted))):
+            self.prepend(zlib.decompress(self.evicted.pop()).decode("utf-8"))
+        scrollbar.setValue(scrollbar.value() + scrollbar.maximum() - height)
+        self.loading = False
+        
+    def clear(self):
+        self.rendered.clear()
+        self.evicted.clear()
+        self.browser.clear()
+
+class ThemeEngine:
+    """Colour themes compiled into one application-wide stylesheet.
+    
+    The built-in light and dark themes can be extended or overridden by
+    ~/.plunket/themes/<name>.json files holding colour values and an
+    optional "extends" (default "light"). Each theme is substituted into
+    TEMPLATE once and cached, so switching is a single
+    QApplication.setStyleSheet and one polish pass.
+    """
+    
+    TEMPLATE = string.Template("""
+        QWidget#container, QWidget#container * {
+            background-color: $window;
+            border-radius: 10px;
+            border: 1px solid $window_border;
+        }
+        QLabel#titleLabel {
+            background-color: transparent;
+            color: $title;
+        }
+        QPushButton#themeButton {
+            background-color: transparent;
+            color: $button_text;
+            border: 1px solid $button_border;
+            border-radius: 3px;
+            padding: 4px 8px;
+        }
+        QPushButton#themeButton:hover {
+            background-color: $button_hover;
+        }
+        QPushButton#closeButton {
+            background-color: transparent;
+            color: $close;
+            border: none;
+            padding: 0px;
+        }
+        QPushButton#closeButton:hover {
+            color: $close_hover;
+        }
+        QLabel#faceLabel {
+            background-color: transparent;
+            color: $face;
+        }
+        QTextBrowser#chatHistory {
+            background-color: $chat_background;
+            color: $chat_text;
+            border: 1px solid $chat_border;
+            border-radius: 6px;
+            padding: 10px;
+        }
+        QTextBrowser#chatHistory QScrollBar:vertical {
+            background: transparent;
+            width: 8px;
+        }
+        QTextBrowser#chatHistory QScrollBar::handle:vertical {
+            background: $scrollbar;
+            border-radius: 4px;
+        }
+        QLineEdit#inputField {
+            background-color: $input_background;
+            color: $input_text;
+            border: 1px solid $input_border;
+            border-radius: 6px;
+            padding: 10px;
+        }
+        QLineEdit#inputField:focus {
+            border: 1px solid $input_focus;
+        }
+    """)
+    BUILTIN = {
+        "light": {
+            "dark": False,
+            "window": "rgb(250, 250, 250)",
+            "window_border": "rgb(200, 200, 200)",
+            "title": "#666",
+            "face": "#333",
+            "button_text": "#666",
+            "button_border": "#ccc",
+            "button_hover": "rgba(0, 0, 0, 0.05)",
+            "close": "#888",
+            "close_hover": "#333",
+            "chat_background": "rgb(245, 245, 245)",
+            "chat_text": "#2a2a2a",
+            "chat_border": "#ddd",
+            "scrollbar": "#ccc",
+            "input_background": "rgb(255, 255, 255)",
+            "input_text": "#2a2a2a",
+            "input_border": "#ddd",
+            "input_focus": "#999",
+        },
+        "dark": {
+            "dark": True,
+            "window": "rgb(35, 35, 38)",
+            "window_border": "rgb(60, 60, 63)",
+            "face": "#ddd",
+            "button_text": "#aaa",
+            "button_border": "#555",
+            "button_hover": "rgba(255, 255, 255, 0.05)",
+            "chat_background": "rgb(45, 45, 48)",
+            "chat_text": "#e0e0e0",
+            "chat_border": "#555",
+            "scrollbar": "#666",
+            "input_background": "rgb(45, 45, 48)",
+            "input_text": "#e0e0e0",
+            "input_border": "#555",
+            "input_focus": "#777",
+        },
+    }
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self.themes = {}
+        self.compiled = {}
+        self.compile_ms = {}
+        self.apply_ms = None
+        self.load()
+        
+    def load(self):
+        """(Re)read theme files; compiled stylesheets are dropped so edits take effect"""
+        self.themes = dict(self.BUILTIN)
+        self.compiled.clear()
+        self.compile_ms.clear()
+        try:
+            filenames = sorted(os.listdir(self.directory))
+        except OSError:
+            return
+        for filename in filenames:
+            if not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename), encoding="utf-8") as f:
+                    theme = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if isinstance(theme, dict):
+                self.themes[filename[:-len(".json")]] = theme
                 
-        except Exception as e:
-            self.error_occurred.emit(f"Error: {str(e)}")
+    def resolve(self, name, seen=()):
+        theme = self.themes[name]
+        base = theme.get("extends", "light" if name != "light" else None)
+        values = {}
+        if base in self.themes and base not in seen and base != name:
+            values = self.resolve(base, seen + (name,))
+        values.update(theme)
+        values.pop("extends", None)
+        return values
+        
+    def is_dark(self, name):
+        return bool(self.resolve(name).get("dark"))
+        
+    def stylesheet(self, name):
+        if name not in self.compiled:
+            start = time.perf_counter()
+            self.compiled[name] = self.TEMPLATE.safe_substitute(self.resolve(name))
+            self.compile_ms[name] = (time.perf_counter() - start) * 1000
+        return self.compiled[name]
+        
+    def apply(self, name):
+        """Install a theme on the application; returns milliseconds spent in setStyleSheet"""
+        stylesheet = self.stylesheet(name)
+        start = time.perf_counter()
+        QApplication.instance().setStyleSheet(stylesheet)
+        self.apply_ms = (time.perf_counter() - start) * 1000
+        return self.apply_ms
+
+class StallWatchdog:
+    """Detects event-loop stalls and records what the UI thread was doing.
+    
+    A QTimer beats on the UI thread every threshold/2. A watchdog thread
+    wakes at the same rate and, when a beat is overdue by more than the
+    threshold, captures the UI thread's Python stack with
+    sys._current_frames(). The beat that ends the stall measures it and
+    files it into a histogram and per-offender totals; the watchdog
+    thread appends it to the log so the UI thread never touches disk.
+    """
+    
+    BUCKETS = (250, 500, 1000, 2000, 5000)
+    DEPTH = 12
+    
+    def __init__(self, threshold_ms=250, log_path=None):
+        self.threshold = threshold_ms / 1000
+        self.interval = max(self.threshold / 2, 0.05)
+        self.log_path = log_path
+        self.main_id = threading.get_ident()
+        self.script = os.path.abspath(__file__)
+        self.beats = 0
+        self.last_beat = time.monotonic()
+        self.captured = None
+        self.stalls = 0
+        self.worst = 0.0
+        self.histogram = [0] * (len(self.BUCKETS) + 1)
+        self.offenders = {}
+        self.pending = queue.Queue()
+        self.halt = threading.Event()
+        self.timer = QTimer()
+        self.timer.setInterval(int(self.interval * 1000))
+        self.timer.timeout.connect(self.beat)
+        self.thread = threading.Thread(target=self.watch, name="stall-watchdog", daemon=True)
+        
+    def start(self):
+        self.last_beat = time.monotonic()
+        self.timer.start()
+        self.thread.start()
+        
+    def stop(self):
+        self.timer.stop()
+        self.halt.set()
+        if self.thread.is_alive():
+            self.thread.join(1.0)
+            
+    def beat(self):
+        now = time.monotonic()
+        stalled = now - self.last_beat - self.interval
+        beat = self.beats
+        self.last_beat = now
+        self.beats += 1
+        if stalled >= self.threshold:
+            captured = self.captured
+            self.record(stalled * 1000, captured[1] if captured and captured[0] == beat else None)
+            
+    def watch(self):
+        while not self.halt.wait(self.interval):
+            beat = self.beats
+            overdue = time.monotonic() - self.last_beat - self.interval
+            if overdue >= self.threshold and (self.captured is None or self.captured[0] != beat):
+                frame = sys._current_frames().get(self.main_id)
+                if frame is not None:
+                    self.captured = (beat, traceback.extract_stack(frame)[-self.DEPTH:])
+            self.flush()
+        self.flush()
+        
+    def offender(self, stack):
+        """Innermost frame of this script in the captured stack, else the innermost frame"""
+        if not stack:
+            return "unknown (no stack captured)"
+        frame = next((f for f in reversed(stack) if os.path.abspath(f.filename) == self.script), stack[-1])
+        return f"{frame.name} (line {frame.lineno})"
+        
+    def record(self, ms, stack):
+        self.stalls += 1
+        self.worst = max(self.worst, ms)
+        self.histogram[bisect.bisect(self.BUCKETS, ms)] += 1
+        offender = self.offender(stack)
+        count, total, worst = self.offenders.get(offender, (0, 0.0, 0.0))
+        self.offenders[offender] = (count + 1, total + ms, max(worst, ms))
+        self.pending.put((time.time(), ms, offender, stack))
+        
+    def flush(self):
+        entries = []
+        while True:
+            try:
+                entries.append(self.pending.get_nowait())
+            except queue.Empty:
+                break
+        if not entries or self.log_path is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                for when, ms, offender, stack in entries:
+                    f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(when))} stall {ms:.0f} ms in {offender}\n")
+                    if stack:
+                        f.write("".join(traceback.format_list(stack)))
+        except OSError:
+            pass
+            
+    def summary(self):
+        if not self.stalls:
+            return [f"No stalls over {self.threshold * 1000:.0f} ms since startup."]
+        lines = [f"{self.stalls} stall(s) over {self.threshold * 1000:.0f} ms, worst {self.worst:.0f} ms."]
+        edges = (self.threshold * 1000,) + self.BUCKETS
+        buckets = []
+        for i, count in enumerate(self.histogram):
+            if count:
+                label = f"{edges[i]:.0f}-{edges[i + 1]:.0f} ms" if i + 1 < len(edges) else f"{edges[i]:.0f}+ ms"
+                buckets.append(f"{label}: {count}")
+        lines.append("Histogram: " + ", ".join(buckets))
+        ranked = sorted(self.offenders.items(), key=lambda item: item[1][1], reverse=True)[:5]
+        lines.append("Worst offenders:")
+        for offender, (count, total, worst) in ranked:
+            lines.append(f"{offender}: {count}x, {total:.0f} ms total, worst {worst:.0f} ms")
+        return lines
 
 class Plunket(QWidget):
     def __init__(self):
         super().__init__()
         
         self.api_key = "YOUR_OPENAI_API_KEY_HERE"
+        self.config = load_config()
         
         self.mood = 'neutral'
         self.moods = {
@@ -90,16 +1900,58 @@ class Plunket(QWidget):
             'thinking': {'face': '(¬‿¬)', 'msg': ""}
         }
         
-        self.conversation_history = [
-            {"role": "system", "content": "You are Plunket, a helpful desktop companion. Keep responses concise and natural."}
-        ]
+        self.context = ContextManager(
+            "You are Plunket, a helpful desktop companion. Keep responses concise and natural.",
+            self.config["context_budget"]
+        )
+        self.summary_thread = None
+        self.cache = ResponseCache(
+            os.path.join(CONFIG_DIR, "cache.sqlite3"),
+            self.config["cache_memory_entries"],
+            self.config["cache_disk_entries"],
+            self.config["cache_ttl"]
+        )
+        self.cache_enabled = self.config["cache_enabled"]
+        self.store = ConversationStore(os.path.join(CONFIG_DIR, "history.sqlite3")) if self.config["history_enabled"] else None
         
+        self.themes = ThemeEngine(os.path.join(CONFIG_DIR, "themes"))
+        self.theme = self.config["theme"] if self.config["theme"] in self.themes.themes else "light"
         self.dark_mode = False
         self.dragging = False
         self.offset = QPoint()
-        self.chat_thread = None
+        self.backends = {name: Backend(name, settings) for name, settings in self.config["backends"].items()}
+        self.backend = self.backends.get(self.config["backend"]) or self.backends["openai"]
+        self.latency = LatencyStats(os.path.join(CONFIG_DIR, "latency.json"))
+        self.router = Router(self.latency)
+        self.routing = self.config["routing"]
+        self.hedging = self.config["hedging"]
+        self.stream_replies = True
+        self.active_prompt = None
+        self.prompt_queue = deque()
+        self.chat_thread = OpenAIThread(
+            self.stream_replies,
+            self.config["retry_attempts"],
+            self.config["retry_max_delay"],
+            self.latency
+        )
+        self.chat_thread.token_received.connect(self.handle_token)
+        self.chat_thread.response_ready.connect(self.handle_response)
+        self.chat_thread.error_occurred.connect(self.handle_error)
+        self.chat_thread.usage_reported.connect(self.context.calibrate)
+        self.chat_thread.answered_by.connect(self.handle_answered_by)
+        self.render_thread = RenderThread()
+        self.render_thread.rendered.connect(self.handle_render)
+        self.renders = {}
+        self.render_count = 0
+        
+        self.watchdog = None
+        self.first_paint = False
+        STARTUP.mark("Plunket state")
         
         self.init_ui()
+        STARTUP.mark("init_ui")
+        self.apply_theme(self.theme)
+        STARTUP.mark("theme")
         
     def init_ui(self):
         self.setWindowTitle('Plunket')
@@ -112,11 +1964,7 @@ class Plunket(QWidget):
         main_layout.setContentsMargins(10, 10, 10, 10)
         
         self.container = QWidget()
-        self.container.setStyleSheet("""
-            background-color: rgb(250, 250, 250);
-            border-radius: 10px;
-            border: 1px solid rgb(200, 200, 200);
-        """)
+        self.container.setObjectName("container")
         container_layout = QVBoxLayout()
         container_layout.setContentsMargins(15, 15, 15, 15)
         container_layout.setSpacing(12)
@@ -125,42 +1973,21 @@ class Plunket(QWidget):
         
         title_label = QLabel('Plunket')
         title_label.setFont(QFont('Arial', 11))
-        title_label.setStyleSheet("background-color: transparent; color: #666;")
+        title_label.setObjectName("titleLabel")
         top_bar.addWidget(title_label)
         
         top_bar.addStretch()
         
         self.theme_btn = QPushButton('🌙')
         self.theme_btn.setFont(QFont('Arial', 14))
-        self.theme_btn.setStyleSheet("""
-            QPushButton {
-                background-color: transparent;
-                color: #666;
-                border: 1px solid #ccc;
-                border-radius: 3px;
-                padding: 4px 8px;
-            }
-            QPushButton:hover {
-                background-color: rgba(0, 0, 0, 0.05);
-            }
-        """)
+        self.theme_btn.setObjectName("themeButton")
         self.theme_btn.setFixedSize(32, 24)
         self.theme_btn.clicked.connect(self.toggle_dark_mode)
         top_bar.addWidget(self.theme_btn)
         
         close_btn = QPushButton('×')
         close_btn.setFont(QFont('Arial', 16, QFont.Bold))
-        close_btn.setStyleSheet("""
-            QPushButton {
-                background-color: transparent;
-                color: #888;
-                border: none;
-                padding: 0px;
-            }
-            QPushButton:hover {
-                color: #333;
-            }
-        """)
+        close_btn.setObjectName("closeButton")
         close_btn.setFixedSize(24, 24)
         close_btn.clicked.connect(self.close)
         top_bar.addWidget(close_btn)
@@ -170,36 +1997,25 @@ class Plunket(QWidget):
         self.face_label = QLabel(self.moods[self.mood]['face'])
         self.face_label.setFont(QFont('Courier New', 48))
         self.face_label.setAlignment(Qt.AlignCenter)
-        self.face_label.setStyleSheet("background-color: transparent; color: #333;")
+        self.face_label.setObjectName("faceLabel")
         self.face_label.setMinimumHeight(80)
         container_layout.addWidget(self.face_label)
         
         self.chat_history = QTextBrowser()
         self.chat_history.setOpenExternalLinks(True)
         self.chat_history.setFont(QFont('Arial', 11))
-        self.chat_history.setStyleSheet("""
-            QTextBrowser {
-                background-color: rgb(245, 245, 245);
-                color: #2a2a2a;
-                border: 1px solid #ddd;
-                border-radius: 6px;
-                padding: 10px;
-            }
-            QScrollBar:vertical {
-                background: transparent;
-                width: 8px;
-            }
-            QScrollBar::handle:vertical {
-                background: #ccc;
-                border-radius: 4px;
-            }
-        """)
+        self.chat_history.setObjectName("chatHistory")
         self.chat_history.setMinimumHeight(350)
         self.chat_history.setLineWrapMode(QTextBrowser.WidgetWidth)
         self.chat_history.setVerticalScrollBarPolicy(Qt.ScrollBarAsNeeded)
         container_layout.addWidget(self.chat_history)
+        self.chat_document = ChatDocument(
+            self.chat_history,
+            self.config["scrollback_limit"],
+            self.config["scrollback_page"]
+        )
         
-        if self.api_key == "YOUR_OPENAI_API_KEY_HERE":
+        if self.needs_key():
             self.add_message("System", "To use Plunket, you need an OpenAI API key.")
             self.add_message("System", '<a href="https://platform.openai.com/api-keys" style="color: #4285f4;">Click here to get your OpenAI API Key</a>')
             self.add_message("System", "Once you have your key, paste it in the chat below to activate Plunket.")
@@ -211,18 +2027,7 @@ class Plunket(QWidget):
         self.input_field = QLineEdit()
         self.input_field.setPlaceholderText("Type here...")
         self.input_field.setFont(QFont('Arial', 11))
-        self.input_field.setStyleSheet("""
-            QLineEdit {
-                background-color: rgb(255, 255, 255);
-                color: #2a2a2a;
-                border: 1px solid #ddd;
-                border-radius: 6px;
-                padding: 10px;
-            }
-            QLineEdit:focus {
-                border: 1px solid #999;
-            }
-        """)
+        self.input_field.setObjectName("inputField")
         self.input_field.setMinimumHeight(40)
         self.input_field.returnPressed.connect(self.handle_input)
         input_layout.addWidget(self.input_field)
@@ -233,126 +2038,37 @@ class Plunket(QWidget):
         main_layout.addWidget(self.container)
         self.setLayout(main_layout)
         
-    def update_theme(self):
-        if self.dark_mode:
-            self.container.setStyleSheet("""
-                background-color: rgb(35, 35, 38);
-                border-radius: 10px;
-                border: 1px solid rgb(60, 60, 63);
-            """)
-            
-            self.face_label.setStyleSheet("background-color: transparent; color: #ddd;")
-            
-            self.chat_history.setStyleSheet("""
-                QTextBrowser {
-                    background-color: rgb(45, 45, 48);
-                    color: #e0e0e0;
-                    border: 1px solid #555;
-                    border-radius: 6px;
-                    padding: 10px;
-                }
-                QScrollBar:vertical {
-                    background: transparent;
-                    width: 8px;
-                }
-                QScrollBar::handle:vertical {
-                    background: #666;
-                    border-radius: 4px;
-                }
-            """)
-            
-            self.input_field.setStyleSheet("""
-                QLineEdit {
-                    background-color: rgb(45, 45, 48);
-                    color: #e0e0e0;
-                    border: 1px solid #555;
-                    border-radius: 6px;
-                    padding: 10px;
-                }
-                QLineEdit:focus {
-                    border: 1px solid #777;
-                }
-            """)
-            
-            self.theme_btn.setStyleSheet("""
-                QPushButton {
-                    background-color: transparent;
-                    color: #aaa;
-                    border: 1px solid #555;
-                    border-radius: 3px;
-                    padding: 4px 8px;
-                }
-                QPushButton:hover {
-                    background-color: rgba(255, 255, 255, 0.05);
-                }
-            """)
-        else:
-            self.container.setStyleSheet("""
-                background-color: rgb(250, 250, 250);
-                border-radius: 10px;
-                border: 1px solid rgb(200, 200, 200);
-            """)
-            
-            self.face_label.setStyleSheet("background-color: transparent; color: #333;")
-            
-            self.chat_history.setStyleSheet("""
-                QTextBrowser {
-                    background-color: rgb(245, 245, 245);
-                    color: #2a2a2a;
-                    border: 1px solid #ddd;
-                    border-radius: 6px;
-                    padding: 10px;
-                }
-                QScrollBar:vertical {
-                    background: transparent;
-                    width: 8px;
-                }
-                QScrollBar::handle:vertical {
-                    background: #ccc;
-                    border-radius: 4px;
-                }
-            """)
-            
-            self.input_field.setStyleSheet("""
-                QLineEdit {
-                    background-color: rgb(255, 255, 255);
-                    color: #2a2a2a;
-                    border: 1px solid #ddd;
-                    border-radius: 6px;
-                    padding: 10px;
-                }
-                QLineEdit:focus {
-                    border: 1px solid #999;
-                }
-            """)
-            
-            self.theme_btn.setStyleSheet("""
-                QPushButton {
-                    background-color: transparent;
-                    color: #666;
-                    border: 1px solid #ccc;
-                    border-radius: 3px;
-                    padding: 4px 8px;
-                }
-                QPushButton:hover {
-                    background-color: rgba(0, 0, 0, 0.05);
-                }
-            """)
-    
-    def toggle_dark_mode(self):
-        self.dark_mode = not self.dark_mode
+    def apply_theme(self, name):
+        elapsed = self.themes.apply(name)
+        self.theme = name
+        self.dark_mode = self.themes.is_dark(name)
         self.theme_btn.setText('☀️' if self.dark_mode else '🌙')
-        self.update_theme()
+        return elapsed
         
-    def add_message(self, sender, message):
+    def show_themes(self):
+        names = [f"<b>{html.escape(name)}</b>" if name == self.theme else html.escape(name) for name in self.themes.themes]
+        self.add_message("System", f"Themes: {', '.join(names)}")
+        compiled = ", ".join(f"{name} {ms:.2f} ms" for name, ms in self.themes.compile_ms.items())
+        self.add_message("System", f"Last switch took {self.themes.apply_ms:.1f} ms. Compiled: {compiled}")
+        
+    def toggle_dark_mode(self):
+        self.apply_theme("light" if self.dark_mode else "dark")
+        
+    def format_message(self, sender, message):
         if sender == "You":
             formatted = f'<p style="margin: 8px 0;"><span style="color: #666; font-weight: 500;">{sender}:</span> {message}</p>'
         elif sender == "System":
             formatted = f'<p style="margin: 8px 0; color: #999; font-size: 10px;">{message}</p>'
         else:
             formatted = f'<p style="margin: 8px 0;"><span style="color: #666; font-weight: 500;">{sender}:</span> {message}</p>'
+        return formatted
         
-        self.chat_history.append(formatted)
+    def add_message(self, sender, message):
+        chat_message = self.chat_document.append(self.format_message(sender, message))
+        self.scroll_to_bottom()
+        return chat_message
+        
+    def scroll_to_bottom(self):
         self.chat_history.verticalScrollBar().setValue(
             self.chat_history.verticalScrollBar().maximum()
         )
@@ -367,15 +2083,26 @@ class Plunket(QWidget):
             self.add_message("System", "/commands - Show this list")
             self.add_message("System", "/clear - Clear chat history")
             self.add_message("System", "/mood [name] - Change mood (happy, excited, sleepy, sad, surprised, thinking)")
+            self.add_message("System", "/theme [name|reload] - List, switch or reload colour themes")
             self.add_message("System", "/reset - Reset API key")
+            self.add_message("System", "/backend [name] - List or switch chat backends")
+            self.add_message("System", "/model [name] - Show or change the backend's model")
+            self.add_message("System", "/route [on|off] - Show backend latency, or pick the backend per prompt")
+            self.add_message("System", "/hedge [on|off] - Show or control hedged requests")
+            self.add_message("System", "/latency - Show connection reuse savings")
+            self.add_message("System", "/stalls - Show UI freezes and what caused them")
+            self.add_message("System", "/context - Show context window usage")
+            self.add_message("System", "/cache [on|off|clear] - Show or control the response cache")
+            self.add_message("System", "/search [terms] - Search past conversations")
+            self.add_message("System", "/queue - Show queued prompts and wait times")
+            self.add_message("System", "/stop - Abort the current reply and drop queued prompts")
             self.input_field.clear()
             return
         
         if text == "/clear":
-            self.chat_history.clear()
-            self.conversation_history = [
-                {"role": "system", "content": "You are Plunket, a helpful desktop companion. Keep responses concise and natural."}
-            ]
+            self.stop_prompts()
+            self.chat_document.clear()
+            self.context.reset()
             self.add_message("System", "Chat history cleared.")
             self.input_field.clear()
             return
@@ -390,17 +2117,141 @@ class Plunket(QWidget):
             self.input_field.clear()
             return
         
+        if text == "/theme" or text.startswith("/theme "):
+            option = text[len("/theme"):].strip()
+            if option == "reload":
+                self.themes.load()
+                if self.theme not in self.themes.themes:
+                    self.theme = "light"
+                elapsed = self.apply_theme(self.theme)
+                self.add_message("System", f"Reloaded {len(self.themes.themes)} themes ({elapsed:.1f} ms to apply).")
+            elif option in self.themes.themes:
+                cached = option in self.themes.compiled
+                elapsed = self.apply_theme(option)
+                compiled = "cached" if cached else f"compiled in {self.themes.compile_ms[option]:.2f} ms"
+                self.add_message("System", f"Theme {html.escape(option)} applied in {elapsed:.1f} ms ({compiled}).")
+            elif option:
+                self.add_message("System", f"Unknown theme. Available: {html.escape(', '.join(self.themes.themes))}")
+            else:
+                self.show_themes()
+            self.input_field.clear()
+            return
+        
+        if text == "/backend" or text.startswith("/backend "):
+            option = text[len("/backend"):].strip()
+            if option in self.backends:
+                self.backend = self.backends[option]
+                self.add_message("System", f"Backend switched to {self.backend.describe()}.")
+                if self.needs_key():
+                    self.add_message("System", "This backend needs an API key; paste it in the chat.")
+            elif option:
+                self.add_message("System", f"Unknown backend. Available: {html.escape(', '.join(self.backends))}")
+            else:
+                for backend in self.backends.values():
+                    line = backend.describe()
+                    self.add_message("System", f"<b>{line}</b>" if backend is self.backend else line)
+            self.input_field.clear()
+            return
+        
+        if text == "/model" or text.startswith("/model "):
+            option = text[len("/model"):].strip()
+            if option:
+                self.backend.model = option
+                self.add_message("System", f"{html.escape(self.backend.name)} now uses {html.escape(option)} for this session.")
+            else:
+                self.add_message("System", f"Model: {self.backend.describe()}")
+            self.input_field.clear()
+            return
+        
+        if text == "/route" or text.startswith("/route "):
+            option = text[len("/route"):].strip()
+            if option in ("on", "off"):
+                self.routing = option == "on"
+                self.add_message("System", f"Routing {option}.")
+            else:
+                self.show_routes()
+            self.input_field.clear()
+            return
+        
+        if text == "/hedge" or text.startswith("/hedge "):
+            option = text[len("/hedge"):].strip()
+            if option in ("on", "off"):
+                self.hedging = option == "on"
+                self.add_message("System", f"Hedged requests {option}.")
+            else:
+                self.add_message("System", (
+                    f"Hedging is {'on' if self.hedging else 'off'}: {self.chat_thread.hedges} hedged requests sent, "
+                    f"{self.chat_thread.hedges_won} answered first."
+                ))
+            self.input_field.clear()
+            return
+        
+        if text == "/context":
+            self.add_message("System", (
+                f"Context: {len(self.context.turns)} messages, ~{self.context.tokens_in_use()} of "
+                f"{self.context.budget} tokens, {self.context.chars_per_token:.2f} chars/token"
+                + (", older turns summarised." if self.context.summary else ".")
+            ))
+            self.input_field.clear()
+            return
+        
+        if text == "/cache" or text.startswith("/cache "):
+            option = text[len("/cache"):].strip()
+            if option in ("on", "off"):
+                self.cache_enabled = option == "on"
+                self.add_message("System", f"Response cache {option}.")
+            elif option == "clear":
+                self.cache.clear()
+                self.add_message("System", "Response cache cleared.")
+            else:
+                state = "on" if self.cache_enabled else "off"
+                self.add_message("System", f"{self.cache.stats()}. Caching is {state}.")
+            self.input_field.clear()
+            return
+        
+        if text == "/queue":
+            self.show_queue()
+            self.input_field.clear()
+            return
+        
+        if text == "/stop":
+            stopped, dropped = self.stop_prompts()
+            if stopped or dropped:
+                self.add_message("System", f"Stopped. {dropped} queued prompt(s) dropped.")
+            else:
+                self.add_message("System", "Nothing to stop.")
+            self.input_field.clear()
+            return
+        
+        if text == "/search" or text.startswith("/search "):
+            self.search_history(text[len("/search"):].strip())
+            self.input_field.clear()
+            return
+        
+        if text == "/stalls":
+            if self.watchdog is None:
+                self.add_message("System", "Stall watchdog is not running yet.")
+            else:
+                for line in self.watchdog.summary():
+                    self.add_message("System", html.escape(line))
+            self.input_field.clear()
+            return
+        
+        if text == "/latency":
+            self.add_message("System", self.chat_thread.stats.summary())
+            self.input_field.clear()
+            return
+        
         if text == "/reset":
+            self.stop_prompts()
             self.api_key = "YOUR_OPENAI_API_KEY_HERE"
-            self.chat_history.clear()
-            self.conversation_history = [
-                {"role": "system", "content": "You are Plunket, a helpful desktop companion. Keep responses concise and natural."}
-            ]
+            self.chat_document.clear()
+            self.context.reset()
             self.add_message("System", "API key reset. Please enter a new API key to continue.")
             self.input_field.clear()
             return
         
-        if self.api_key == "YOUR_OPENAI_API_KEY_HERE":
+        if self.needs_key():
             if text.startswith("sk-"):
                 self.api_key = text
                 self.add_message("System", "API key saved! You can now chat with Plunket.")
@@ -413,48 +2264,269 @@ class Plunket(QWidget):
             
         self.add_message("You", text)
         self.input_field.clear()
-        self.input_field.setEnabled(False)
+        
+        prompt = PendingPrompt(text)
+        if self.active_prompt is None:
+            self.dispatch(prompt)
+        else:
+            self.prompt_queue.append(prompt)
+            self.add_message("System", f"Queued ({len(self.prompt_queue)} waiting). Type /stop to cancel.")
+            self.update_queue_status()
+        
+    def dispatch(self, prompt):
+        history = self.context.build(prompt.text)
+        prompt.messages = history + [{"role": "user", "content": prompt.text}]
+        backends = self.route(prompt.messages)
+        prompt.backend = backends[0]
+        key = ResponseCache.key(prompt.backend.base_url, prompt.backend.model, prompt.backend.parameters, prompt.messages)
+        cached = self.cache.get(key) if self.cache_enabled else None
+        if cached is not None:
+            message = self.add_message("Plunket", f'{html.escape(cached)} <span style="color: #999; font-size: 10px;">(cached)</span>')
+            self.start_render(message, self.reply_label(cached=True), cached, final=True)
+            self.record_turn(prompt.text, cached)
+            self.dispatch_next()
+            return
         
         self.change_mood('thinking')
-        self.add_message("Plunket", "...")
+        prompt.started_at = time.monotonic()
+        prompt.reply_message = self.add_message("Plunket", "...")
+        prompt.reply_message.pinned = True
+        prompt.key = key if self.cache_enabled else None
+        hedge = self.hedge_for(prompt.backend, backends, prompt.messages) if self.hedging else None
+        fallbacks = [backend for backend in backends[1:] if backend is not hedge] if self.routing else []
+        prompt.job_id = self.chat_thread.submit(prompt.backend, self.api_key, prompt.text, history,
+                                                hedge, self.hedge_delay(prompt.backend), fallbacks)
+        self.active_prompt = prompt
+        self.update_queue_status()
         
-        self.chat_thread = OpenAIThread(self.api_key, text, self.conversation_history)
-        self.chat_thread.response_ready.connect(self.handle_response)
-        self.chat_thread.error_occurred.connect(self.handle_error)
-        self.chat_thread.start()
+    def dispatch_next(self):
+        if self.active_prompt is not None:
+            self.active_prompt.reply_message.pinned = False
+        self.active_prompt = None
+        if self.prompt_queue:
+            self.dispatch(self.prompt_queue.popleft())
+        else:
+            self.change_mood('neutral')
+            self.update_queue_status()
+            
+    def update_queue_status(self):
+        waiting = len(self.prompt_queue)
+        self.input_field.setPlaceholderText(f"Type here... ({waiting} queued)" if waiting else "Type here...")
         
-    def handle_response(self, response):
-        html = self.chat_history.toHtml()
-        lines = html.split('<p')
-        if len(lines) > 1:
-            html = '<p'.join(lines[:-1])
-        self.chat_history.setHtml(html)
+    def show_queue(self):
+        now = time.monotonic()
+        if self.active_prompt is None:
+            self.add_message("System", "Nothing in flight.")
+            return
+        self.add_message("System", f"In flight for {now - self.active_prompt.started_at:.1f}s "
+                                   f"(waited {self.active_prompt.started_at - self.active_prompt.queued_at:.1f}s)")
+        for position, prompt in enumerate(self.prompt_queue, 1):
+            self.add_message("System", f"#{position} waiting {now - prompt.queued_at:.1f}s: {html.escape(prompt.text[:60])}")
         
-        self.add_message("Plunket", response)
+    def stop_prompts(self):
+        dropped = len(self.prompt_queue)
+        self.prompt_queue.clear()
+        prompt = self.active_prompt
+        if prompt is not None:
+            self.chat_thread.cancel(prompt.job_id)
+            if prompt.streaming:
+                prompt.render.tail = self.chat_document.extend(prompt.reply_message, prompt.render.tail, " [stopped]")
+                self.update_render(prompt.render, prompt.render.text + " [stopped]", final=True)
+            else:
+                self.chat_document.remove(prompt.reply_message)
+        self.dispatch_next()
+        return prompt is not None, dropped
         
-        user_message = self.chat_thread.message
+    def search_history(self, terms):
+        if self.store is None:
+            self.add_message("System", "Conversation history is turned off.")
+            return
+        if not terms:
+            self.add_message("System", "Usage: /search [terms]")
+            return
+        start = time.perf_counter()
+        results = self.store.search(terms)
+        elapsed = (time.perf_counter() - start) * 1000
+        self.add_message("System", f"<b>{len(results)} results for \"{html.escape(terms)}\"</b> ({elapsed:.1f} ms)")
+        for created, role, snippet in results:
+            stamp = time.strftime("%Y-%m-%d %H:%M", time.localtime(created))
+            self.add_message("System", f"{stamp} {role}: {snippet}")
         
-        self.conversation_history.append({"role": "user", "content": user_message})
-        self.conversation_history.append({"role": "assistant", "content": response})
+    def handle_token(self, job_id, token):
+        prompt = self.active_prompt
+        if prompt is None or prompt.job_id != job_id:
+            return
+        render = prompt.render
+        if not prompt.streaming:
+            self.chat_document.replace(prompt.reply_message, self.format_message("Plunket", ""))
+            prompt.streaming = True
+            render = prompt.render = self.start_render(prompt.reply_message, self.reply_label())
+            token = token.lstrip()
+            render.tail = self.chat_document.extend(prompt.reply_message, render.tail, " " + token)
+        else:
+            render.tail = self.chat_document.extend(prompt.reply_message, render.tail, token)
+        self.update_render(render, render.text + token)
+        self.scroll_to_bottom()
         
-        if len(self.conversation_history) > 11:
-            self.conversation_history = [self.conversation_history[0]] + self.conversation_history[-10:]
+    def handle_response(self, job_id, response):
+        prompt = self.active_prompt
+        if prompt is None or prompt.job_id != job_id:
+            return
+        if prompt.streaming:
+            self.update_render(prompt.render, response.lstrip(), final=True)
+        else:
+            self.chat_document.replace(prompt.reply_message, self.format_message("Plunket", html.escape(response)))
+            prompt.render = self.start_render(prompt.reply_message, self.reply_label(), response, final=True)
+            self.scroll_to_bottom()
         
-        self.change_mood('neutral')
+        self.record_turn(prompt.text, response)
+        if prompt.key is not None:
+            self.cache.put(prompt.key, response)
         
-        self.input_field.setEnabled(True)
+        self.dispatch_next()
         self.input_field.setFocus()
         
-    def handle_error(self, error_msg):
-        html = self.chat_history.toHtml()
-        lines = html.split('<p')
-        if len(lines) > 1:
-            html = '<p'.join(lines[:-1])
-        self.chat_history.setHtml(html)
+    def needs_key(self):
+        return self.backend.api_key is None and self.api_key == "YOUR_OPENAI_API_KEY_HERE"
+        
+    def route(self, messages):
+        """Backends to use for `messages`, best first: ranked by the router when routing is on.
+        
+        With routing on, the rest of the list is also where a prompt falls
+        back to when its backend cannot be reached.
+        """
+        usable = [backend for backend in self.backends.values()
+                  if backend.api_key is not None or self.api_key != "YOUR_OPENAI_API_KEY_HERE"]
+        if self.routing:
+            names = self.config["route_backends"] or list(self.backends)
+            ranked = self.router.rank([backend for backend in usable if backend.name in names],
+                                      LatencyStats.prompt_tokens(messages))
+            if ranked:
+                return ranked + [backend for backend in usable if backend not in ranked]
+        return [self.backend] + [backend for backend in usable if backend is not self.backend]
+        
+    def hedge_for(self, primary, backends, messages):
+        """The configured hedge backend, else the fastest other backend that has been measured and is reachable"""
+        hedge = self.backends.get(self.config["hedge_backend"])
+        if hedge is not None and hedge is not primary and hedge in backends:
+            return hedge
+        prompt_tokens = LatencyStats.prompt_tokens(messages)
+        others = self.router.rank([backend for backend in backends if backend is not primary
+                                   and self.latency.reachable(backend)
+                                   and self.latency.predict(backend, prompt_tokens) is not None], prompt_tokens)
+        return others[0] if others else None
+        
+    def hedge_delay(self, backend):
+        """The backend's first-token percentile, clamped; the maximum until enough replies are measured"""
+        seconds = self.latency.percentile(backend, self.config["hedge_percentile"])
+        if seconds is None:
+            return self.config["hedge_max_delay"]
+        return min(max(seconds, self.config["hedge_min_delay"]), self.config["hedge_max_delay"])
+        
+    def handle_answered_by(self, job_id, name):
+        """Key the cached reply on the backend that answered, after a hedge or fallback"""
+        prompt = self.active_prompt
+        if prompt is None or prompt.job_id != job_id or name == prompt.backend.name or name not in self.backends:
+            return
+        prompt.backend = self.backends[name]
+        if prompt.key is not None:
+            prompt.key = ResponseCache.key(prompt.backend.base_url, prompt.backend.model,
+                                           prompt.backend.parameters, prompt.messages)
+        
+    def show_routes(self):
+        self.add_message("System", f"Routing is {'on' if self.routing else 'off'}. First-token latency per backend:")
+        for backend in self.backends.values():
+            pairs = self.latency.pairs(backend)
+            note = "" if self.latency.reachable(backend) else "; unreachable, ranked last for now"
+            if len(pairs) < LatencyStats.MIN_SAMPLES:
+                self.add_message("System", f"{html.escape(backend.name)}: {len(pairs)} replies measured, not enough to rank yet{note}")
+                continue
+            small = self.latency.predict(backend, 200)
+            large = self.latency.predict(backend, 2000)
+            self.add_message("System", (
+                f"{html.escape(backend.name)}: p50 {self.latency.percentile(backend, 50):.2f}s, "
+                f"p95 {self.latency.percentile(backend, 95):.2f}s over {len(pairs)} replies; "
+                f"predicted {small:.2f}s at 200 tokens, {large:.2f}s at 2000{note}"
+            ))
+        
+    def reply_label(self, cached=False):
+        label = '<span style="color: #666; font-weight: 500;">Plunket:</span>'
+        if cached:
+            label += ' <span style="color: #999; font-size: 10px;">(cached)</span>'
+        return label
+        
+    def start_render(self, message, prefix, text="", final=False):
+        self.render_count += 1
+        render = ReplyRender(self.render_count, message, prefix, text, final)
+        self.renders[render.id] = render
+        if text:
+            self.submit_render(render)
+        return render
+        
+    def update_render(self, render, text, final=False):
+        render.text = text
+        render.final = final
+        if not render.busy:
+            self.submit_render(render)
+        
+    def submit_render(self, render):
+        render.busy = True
+        self.render_thread.submit(render.id, render.text, render.settled, render.final, render.prefix)
+        
+    def handle_render(self, render_id, length, settled, final, settled_html, open_html):
+        """Apply a render result, then queue the next one if more text or the final text is waiting"""
+        render = self.renders.get(render_id)
+        if render is None:
+            return
+        render.busy = False
+        if render.message not in self.chat_document.rendered:
+            del self.renders[render_id]
+            return
+        if settled_html or open_html:
+            render.tail = self.chat_document.replace_tail(render.message, render.tail, settled_html, open_html)
+        render.settled = settled
+        render.length = length
+        if length < len(render.text):
+            render.tail = self.chat_document.extend(render.message, render.tail, render.text[length:])
+        if final and length == len(render.text):
+            del self.renders[render_id]
+        elif render.final or length < len(render.text):
+            self.submit_render(render)
+        self.scroll_to_bottom()
+        
+    def record_turn(self, user_message, reply):
+        self.context.add_turn(user_message, reply)
+        self.fold_context()
+        if self.store is not None:
+            self.store.record("user", user_message)
+            self.store.record("assistant", reply)
+        
+    def fold_context(self):
+        if self.summary_thread is not None and self.summary_thread.isRunning():
+            return
+        turns = self.context.take_overflow()
+        if not turns:
+            return
+        self.summary_thread = SummaryThread(self.backend, self.api_key, self.context.generation, self.context.summary, turns)
+        self.summary_thread.summary_ready.connect(self.handle_summary)
+        self.summary_thread.start()
+        
+    def handle_summary(self, generation, summary):
+        if generation == self.context.generation:
+            self.context.summary = summary
+            self.fold_context()
+        
+    def handle_error(self, job_id, error_msg):
+        prompt = self.active_prompt
+        if prompt is None or prompt.job_id != job_id:
+            return
+        if prompt.streaming:
+            self.update_render(prompt.render, prompt.render.text, final=True)
+        else:
+            self.chat_document.remove(prompt.reply_message)
         
         self.add_message("System", error_msg)
-        self.change_mood('neutral')
-        self.input_field.setEnabled(True)
+        self.dispatch_next()
         self.input_field.setFocus()
         
     def change_mood(self, new_mood):
@@ -462,6 +2534,35 @@ class Plunket(QWidget):
             self.mood = new_mood
             self.face_label.setText(self.moods[new_mood]['face'])
         
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.first_paint:
+            self.first_paint = True
+            STARTUP.mark("first paint")
+            QTimer.singleShot(0, self.startup_idle)
+            
+    def startup_idle(self):
+        STARTUP.mark("event loop idle")
+        if self.watchdog is None and self.config["stall_threshold_ms"] > 0:
+            self.watchdog = StallWatchdog(
+                self.config["stall_threshold_ms"],
+                os.path.join(CONFIG_DIR, "stalls.log") if self.config["stall_log"] else None
+            )
+            self.watchdog.start()
+        if STARTUP.enabled:
+            STARTUP.report()
+            QApplication.instance().quit()
+        
+    def closeEvent(self, event):
+        self.chat_thread.stop()
+        self.latency.save()
+        self.render_thread.stop()
+        if self.watchdog is not None:
+            self.watchdog.stop()
+        if self.store is not None:
+            self.store.close()
+        super().closeEvent(event)
+        
     def mousePressEvent(self, event):
         if event.button() == Qt.LeftButton:
             self.dragging = True
@@ -475,10 +2576,171 @@ class Plunket(QWidget):
         if event.button() == Qt.LeftButton:
             self.dragging = False
 
+def benchmark_chat_document(sizes=(10, 100, 1000, 10000), replies=20):
+    """Time one reply round trip (placeholder, then replace) at several transcript sizes.
+    
+    The documents are made big enough to keep every message; a last row
+    repeats the largest size with the scrollback cap the app uses.
+    """
+    browser = QTextBrowser()
+    print(f"{'messages':>16} {'reply (ms)':>12} {'toHtml/setHtml (ms)':>20}")
+    for size, capped in [(size, False) for size in sizes] + [(max(sizes), True)]:
+        browser.clear()
+        chat = ChatDocument(browser) if capped else ChatDocument(browser, limit=max(sizes) + replies)
+        for i in range(size):
+            chat.append(f'<p style="margin: 8px 0;"><span style="color: #666;">You:</span> message {i}</p>')
+        
+        start = time.perf_counter()
+        for i in range(replies):
+            placeholder = chat.append('<p style="margin: 8px 0;">Plunket: ...</p>')
+            chat.replace(placeholder, f'<p style="margin: 8px 0;">Plunket: reply {i}</p>')
+        reply_ms = (time.perf_counter() - start) / replies * 1000
+        
+        start = time.perf_counter()
+        html = browser.toHtml()
+        lines = html.split('<p')
+        browser.setHtml('<p'.join(lines[:-1]))
+        rewrite_ms = (time.perf_counter() - start) * 1000
+        label = f"{size} ({chat.limit} kept)" if capped else str(size)
+        print(f"{label:>16} {reply_ms:>12.3f} {rewrite_ms:>20.1f}")
+
+def benchmark_markdown(sizes=(500, 1000, 2000, 5000), updates=20):
+    """Time one streaming update at several reply lengths, next to re-rendering the whole reply"""
+    label = '<span style="color: #666; font-weight: 500;">Plunket:</span>'
+    sample = ("Some **bold** text with `inline code` and a [link](https://example.com).\n\n"
+              "- first point\n- second point\n\n"
+              "```python\ndef double(x):\n    return x * 2\n```\n\n")
+    print(f"{'tokens':>10} {'open block (ms)':>16} {'whole reply (ms)':>17}")
+    for size in sizes:
+        text = (sample * (size * 4 // len(sample) + 1))[:size * 4] + "\n\nStill streaming"
+        timings = []
+        for incremental in (True, False):
+            renderer = MarkdownRenderer() if incremental else MarkdownRenderer(block_cache=0, message_cache=0)
+            chat = ChatDocument(QTextBrowser())
+            message = chat.append(f'<p style="margin: 8px 0;">{label}</p>')
+            settled, settled_html, open_html = renderer.update(text, 0, False, label)
+            tail = chat.replace_tail(message, 0, settled_html, open_html)
+            reply = text
+            start = time.perf_counter()
+            for _ in range(updates):
+                reply += " more"
+                if incremental:
+                    settled, settled_html, open_html = renderer.update(reply, settled, False, label)
+                    tail = chat.replace_tail(message, tail, settled_html, open_html)
+                else:
+                    chat.replace(message, renderer.render(reply, label)[1])
+            timings.append((time.perf_counter() - start) / updates * 1000)
+        print(f"{size:>10} {timings[0]:>16.3f} {timings[1]:>17.1f}")
+
+class StubChatHandler(http.server.BaseHTTPRequestHandler):
+    """OpenAI-compatible /v1/chat/completions and /v1/models whose replies echo the last user message"""
+    protocol_version = "HTTP/1.1"
+    
+    def do_GET(self):
+        if not urllib.parse.urlsplit(self.path).path.rstrip("/").endswith("/models"):
+            self.send_error(404)
+            return
+        self.send_json({"object": "list", "data": [{"id": self.server.model, "object": "model", "owned_by": "stub"}]})
+        
+    def do_POST(self):
+        if not urllib.parse.urlsplit(self.path).path.endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            messages = request["messages"]
+            prompt = next(m["content"] for m in reversed(messages) if m["role"] == "user")
+        except (ValueError, KeyError, TypeError, StopIteration):
+            self.send_error(400)
+            return
+        words = re.findall(r"\S+\s*", f"Stub reply to: {prompt}")
+        prompt_tokens = sum(len(m["content"]) for m in messages) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(words), "total_tokens": prompt_tokens + len(words)}
+        model = request.get("model", self.server.model)
+        time.sleep(self.server.latency)
+        if not request.get("stream"):
+            self.send_json({"object": "chat.completion", "model": model, "usage": usage, "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": "".join(words)}, "finish_reason": "stop"}]})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for word in words:
+                self.send_event({"object": "chat.completion.chunk", "model": model,
+                                 "choices": [{"index": 0, "delta": {"content": word}}]})
+                time.sleep(self.server.token_delay)
+            if (request.get("stream_options") or {}).get("include_usage"):
+                self.send_event({"object": "chat.completion.chunk", "model": model, "choices": [], "usage": usage})
+            self.send_chunk(b"data: [DONE]\n\n")
+            self.send_chunk(b"")
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+        
+    def send_json(self, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        
+    def send_event(self, payload):
+        self.send_chunk(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+        
+    def send_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        
+    def log_message(self, format, *args):
+        pass
+
+class StubChatServer(http.server.ThreadingHTTPServer):
+    """Loopback stand-in for a chat backend, so replies can be tested offline"""
+    daemon_threads = True
+    
+    def __init__(self, port, model="stub", latency=0.0, token_delay=0.02):
+        super().__init__(("127.0.0.1", port), StubChatHandler)
+        self.model = model
+        self.latency = latency
+        self.token_delay = token_delay
+        
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+def stub_server(argv):
+    """Serve the stub backend on 127.0.0.1 until interrupted"""
+    parser = argparse.ArgumentParser(prog=os.path.basename(__file__), description="Serve a stub OpenAI-compatible chat backend.")
+    parser.add_argument("--stub-server", type=int, required=True, metavar="PORT")
+    parser.add_argument("--stub-model", default="stub", help="model name reported by /v1/models")
+    parser.add_argument("--stub-latency", type=float, default=0.0, metavar="MS", help="delay before each reply starts")
+    parser.add_argument("--stub-token-delay", type=float, default=20.0, metavar="MS", help="delay between streamed tokens")
+    args = parser.parse_args(argv)
+    server = StubChatServer(args.stub_server, args.stub_model, args.stub_latency / 1000, args.stub_token_delay / 1000)
+    print(f"Stub chat backend on http://127.0.0.1:{args.stub_server}/v1", file=sys.stderr, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
 def main():
+    if any(arg.split("=", 1)[0] == "--stub-server" for arg in sys.argv[1:]):
+        sys.exit(stub_server(sys.argv[1:]))
     app = QApplication(sys.argv)
+    STARTUP.mark("QApplication")
+    if "--bench-chat" in sys.argv:
+        benchmark_chat_document()
+        return
+    if "--bench-markdown" in sys.argv:
+        benchmark_markdown()
+        return
     plunket = Plunket()
     plunket.show()
+    STARTUP.mark("show")
     sys.exit(app.exec_())
 
 if __name__ == '__main__':
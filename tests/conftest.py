@@ -0,0 +1,25 @@
+"""Helpers shared by the tests; pytest loads this first, and unittest discovery can import it"""
+import importlib.util
+import os
+import socket
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+scripts = {}
+
+def load_script(filename):
+    """Import one of the scripts by path ("Plunket&Strata.py" is not a valid module name), once per run"""
+    if filename not in scripts:
+        spec = importlib.util.spec_from_file_location(filename[:-3].replace("&", "_"), os.path.join(ROOT, filename))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        scripts[filename] = module
+    return scripts[filename]
+
+def closed_port():
+    """A loopback port nothing listens on"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
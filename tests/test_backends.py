@@ -0,0 +1,239 @@
+"""Chat requests against the bundled stub backend, so they run offline"""
+import http.server
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from conftest import closed_port, load_script
+
+plunket = load_script("Plunket.py")
+
+class RejectingHandler(http.server.BaseHTTPRequestHandler):
+    """Answers every request 401, like a backend given a bad key"""
+    
+    def do_POST(self):
+        self.send_error(401)
+        
+    def log_message(self, format, *args):
+        pass
+
+class DroppingHandler(plunket.StubChatHandler):
+    """Streams three words of the stub reply, then drops the connection"""
+    
+    def send_event(self, payload):
+        self.sent = getattr(self, "sent", 0) + 1
+        if self.sent > 3:
+            raise ConnectionResetError
+        super().send_event(payload)
+
+class StubRoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = plunket.StubChatServer(0, model="stub-model", token_delay=0)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.backend = plunket.Backend("stub", {"base_url": self.url, "model": "stub-model", "api_key": ""})
+        
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        
+    def chat(self, stream, message="hello there", history=(), backend=None, fallbacks=(), retry_attempts=1):
+        """Run one job on an OpenAIThread in this thread and collect what it emits"""
+        thread = plunket.OpenAIThread(stream, retry_attempts=retry_attempts)
+        thread.session = plunket.requests.Session()
+        self.latency = thread.latency
+        events = {"tokens": [], "replies": [], "errors": [], "usage": [], "answered_by": []}
+        thread.token_received.connect(lambda job_id, token: events["tokens"].append(token))
+        thread.response_ready.connect(lambda job_id, reply: events["replies"].append(reply))
+        thread.error_occurred.connect(lambda job_id, error: events["errors"].append(error))
+        thread.usage_reported.connect(lambda chars, tokens: events["usage"].append(tokens))
+        thread.answered_by.connect(lambda job_id, name: events["answered_by"].append(name))
+        try:
+            thread.process(1, backend or self.backend, None, message, list(history), fallbacks=fallbacks)
+        finally:
+            thread.session.close()
+        return events
+        
+    def test_streamed_reply(self):
+        events = self.chat(stream=True)
+        self.assertEqual(events["errors"], [])
+        self.assertEqual(events["replies"], ["Stub reply to: hello there"])
+        self.assertEqual("".join(events["tokens"]), "Stub reply to: hello there")
+        self.assertGreater(len(events["tokens"]), 1)
+        self.assertEqual(len(events["usage"]), 1)
+        self.assertEqual(events["answered_by"], ["stub"])
+        self.assertEqual(len(self.latency.pairs(self.backend)), 1)
+        
+    def test_plain_reply(self):
+        history = [{"role": "user", "content": "earlier"}, {"role": "assistant", "content": "answer"}]
+        events = self.chat(stream=False, message="again", history=history)
+        self.assertEqual(events["errors"], [])
+        self.assertEqual(events["tokens"], [])
+        self.assertEqual(events["replies"], ["Stub reply to: again"])
+        
+    def test_models(self):
+        models = plunket.requests.get(f"{self.url}/models", timeout=5).json()
+        self.assertEqual([model["id"] for model in models["data"]], ["stub-model"])
+        
+    def test_bad_request(self):
+        response = plunket.requests.post(f"{self.url}/chat/completions", data=b"{}", timeout=5)
+        self.assertEqual(response.status_code, 400)
+        events = self.chat(stream=True, message="")
+        self.assertEqual(events["replies"], ["Stub reply to: "])
+        
+    def test_unreachable_backend(self):
+        self.server.shutdown()
+        self.server.server_close()
+        events = self.chat(stream=True)
+        self.assertEqual(events["replies"], [])
+        self.assertEqual(len(events["errors"]), 1)
+        
+    def test_falls_back_without_retrying(self):
+        dead = plunket.Backend("dead", {"base_url": f"http://127.0.0.1:{closed_port()}/v1", "api_key": ""})
+        start = time.monotonic()
+        events = self.chat(stream=True, backend=dead, fallbacks=[self.backend], retry_attempts=5)
+        self.assertLess(time.monotonic() - start, 2.0)
+        self.assertEqual(events["errors"], [])
+        self.assertEqual(events["replies"], ["Stub reply to: hello there"])
+        self.assertEqual(events["answered_by"], ["stub"])
+        self.assertFalse(self.latency.reachable(dead))
+        self.assertEqual(plunket.Router(self.latency).rank([dead, self.backend], 10), [self.backend, dead])
+        
+    def test_client_errors_are_not_latency(self):
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RejectingHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            rejecting = plunket.Backend("rejecting", {"base_url": f"http://127.0.0.1:{server.server_address[1]}/v1",
+                                                      "api_key": ""})
+            events = self.chat(stream=True, backend=rejecting, fallbacks=[self.backend])
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertEqual(events["errors"], ["API Error: 401"])
+        self.assertEqual(self.latency.pairs(rejecting), [])
+        self.assertTrue(self.latency.reachable(rejecting))
+
+class StopTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = plunket.QApplication.instance() or plunket.QApplication([])
+        
+    def setUp(self):
+        self.servers = [plunket.StubChatServer(0, latency=latency, token_delay=0) for latency in (6.0, 0.0)]
+        for server in self.servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.slow, self.fast = [plunket.Backend(name, {"base_url": f"http://127.0.0.1:{server.server_address[1]}/v1",
+                                                      "api_key": ""})
+                                for name, server in zip(("slow", "fast"), self.servers)]
+        self.thread = plunket.OpenAIThread(True, retry_attempts=1)
+        self.replies = {}
+        self.errors = {}
+        self.thread.response_ready.connect(lambda job_id, reply: self.replies.setdefault(job_id, reply))
+        self.thread.error_occurred.connect(lambda job_id, error: self.errors.setdefault(job_id, error))
+        
+    def tearDown(self):
+        self.thread.stop()
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        
+    def wait_for(self, condition, seconds):
+        deadline = time.monotonic() + seconds
+        while not condition() and time.monotonic() < deadline:
+            self.app.processEvents()
+            time.sleep(0.01)
+        return condition()
+        
+    def test_next_prompt_is_served_promptly_after_stop(self):
+        stopped = self.thread.submit(self.slow, None, "slow one", [])
+        self.wait_for(lambda: False, 0.5)  # the slow request is now waiting for headers
+        start = time.monotonic()
+        self.thread.cancel(stopped)
+        following = self.thread.submit(self.fast, None, "next one", [])
+        self.assertTrue(self.wait_for(lambda: following in self.replies, 2.0))
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual(self.replies[following], "Stub reply to: next one")
+        self.assertNotIn(stopped, self.replies)
+        self.assertNotIn(stopped, self.errors)
+
+class StreamErrorTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = plunket.QApplication.instance() or plunket.QApplication([])
+        
+    def setUp(self):
+        self.server = plunket.StubChatServer(0, token_delay=0)
+        self.server.RequestHandlerClass = DroppingHandler
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        config_path = os.path.join(directory.name, "config.json")
+        with open(config_path, "w", encoding="utf-8") as f:
+            json.dump({"backend": "stub", "cache_enabled": False, "history_enabled": False, "stall_threshold_ms": 0,
+                       "backends": {"stub": {"base_url": f"http://127.0.0.1:{self.server.server_address[1]}/v1",
+                                             "api_key": ""}}}, f)
+        with mock.patch.object(plunket, "CONFIG_DIR", directory.name), mock.patch.object(plunket, "CONFIG_PATH", config_path):
+            self.widget = plunket.Plunket()
+        
+    def tearDown(self):
+        self.widget.close()
+        self.server.shutdown()
+        self.server.server_close()
+        
+    def test_partial_reply_is_finished_before_the_error(self):
+        self.widget.input_field.setText("hello there")
+        self.widget.handle_input()
+        deadline = time.monotonic() + 5.0
+        while (self.widget.active_prompt is not None or self.widget.renders) and time.monotonic() < deadline:
+            self.app.processEvents()
+            time.sleep(0.01)
+        self.assertIsNone(self.widget.active_prompt)
+        self.assertEqual(self.widget.renders, {})
+        lines = self.widget.chat_history.toPlainText().splitlines()
+        self.assertEqual(lines[-2], "Plunket: Stub reply to:")
+        self.assertTrue(lines[-1].startswith("Error: "), lines[-1])
+
+class LatencyStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fast = plunket.Backend("fast", {"base_url": "http://127.0.0.1:1/v1", "model": "fast"})
+        self.slow = plunket.Backend("slow", {"base_url": "http://127.0.0.1:2/v1", "model": "slow"})
+        
+    def test_persists_across_sessions(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "latency.json")
+            stats = plunket.LatencyStats(path)
+            for tokens in range(100, 600, 100):
+                stats.record(self.slow, tokens, tokens / 100)
+            stats.save()
+            again = plunket.LatencyStats(path)
+        self.assertEqual(again.pairs(self.slow), stats.pairs(self.slow))
+        self.assertAlmostEqual(again.predict(self.slow, 1000), 10.0)
+        self.assertEqual(again.percentile(self.slow, 50), 3.0)
+        
+    def test_router_prefers_unmeasured_then_fastest(self):
+        stats = plunket.LatencyStats()
+        router = plunket.Router(stats)
+        for _ in range(stats.MIN_SAMPLES):
+            stats.record(self.slow, 100, 2.0)
+        self.assertEqual(router.rank([self.slow, self.fast], 100), [self.fast, self.slow])
+        for _ in range(stats.MIN_SAMPLES):
+            stats.record(self.fast, 100, 0.5)
+        self.assertEqual(router.rank([self.slow, self.fast], 100), [self.fast, self.slow])
+        self.assertIsNone(stats.percentile(plunket.Backend("new", {}), 95))
+        
+    def test_router_skips_prompts_that_do_not_fit(self):
+        small = plunket.Backend("small", {"context_tokens": 2000, "max_tokens": 500})
+        router = plunket.Router(plunket.LatencyStats())
+        self.assertEqual(router.rank([small, self.fast], 1000), [small, self.fast])
+        self.assertEqual(router.rank([small, self.fast], 1600), [self.fast])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+"""ChatDocument block handles through eviction and reloading"""
+import unittest
+import zlib
+
+from PyQt5.QtGui import QTextDocumentFragment
+
+from conftest import load_script
+
+plunket = load_script("Plunket.py")
+
+class ChatDocumentTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.app = plunket.QApplication.instance() or plunket.QApplication([])
+        
+    def setUp(self):
+        self.browser = plunket.QTextBrowser()
+        self.chat = plunket.ChatDocument(self.browser, limit=10, page=3)
+        
+    def append(self, name):
+        # m1 spans two blocks, the others one
+        body = f"<p>{name}</p><p>{name} more</p>" if name == "m1" else f"<p>{name}</p>"
+        return self.chat.append(body)
+        
+    def text(self, message):
+        return self.chat.select(message).selectedText().replace(" ", "|")
+        
+    def rendered(self):
+        return [self.text(message) for message in self.chat.rendered]
+        
+    def blocks(self):
+        block = self.chat.document.firstBlock()
+        texts = []
+        while block.isValid():
+            texts.append(block.text())
+            block = block.next()
+        return texts
+        
+    def evicted(self):
+        return [QTextDocumentFragment.fromHtml(zlib.decompress(html).decode("utf-8")).toPlainText()
+                for html in self.chat.evicted]
+        
+    def reload(self):
+        self.chat.on_scroll(self.browser.verticalScrollBar().minimum())
+        
+    def test_append_evict_prepend_append(self):
+        for i in range(15):
+            self.append(f"m{i}")
+        self.assertEqual(self.evicted(), ["m0", "m1\nm1 more", "m2", "m3", "m4"])
+        self.assertEqual(self.blocks(), [f"m{i}" for i in range(5, 15)])
+        
+        self.reload()
+        self.assertEqual(self.blocks(), [f"m{i}" for i in range(2, 15)])
+        self.assertEqual(self.rendered(), [f"m{i}" for i in range(2, 15)])
+        self.assertEqual(self.evicted(), ["m0", "m1\nm1 more"])
+        
+        self.reload()
+        self.assertEqual(self.blocks()[:4], ["m0", "m1", "m1 more", "m2"])
+        self.assertEqual(self.rendered()[:3], ["m0", "m1|m1 more", "m2"])
+        self.assertEqual(self.chat.evicted, [])
+        
+        self.append("m15")
+        self.assertEqual(self.blocks(), [f"m{i}" for i in range(6, 16)])
+        self.assertEqual(self.rendered(), [f"m{i}" for i in range(6, 16)])
+        self.assertEqual(self.evicted(), ["m0", "m1\nm1 more", "m2", "m3", "m4", "m5"])
+        
+    def test_replace_after_reload(self):
+        for i in range(12):
+            self.append(f"m{i}")
+        self.reload()
+        first_before = self.chat.rendered[2]
+        self.chat.replace(first_before, "<p>m2 edited</p>")
+        self.chat.replace(self.chat.rendered[0], "<p>m0 edited</p>")
+        self.assertEqual(self.blocks()[:3], ["m0 edited", "m1", "m1 more"])
+        self.assertEqual(self.blocks()[3], "m2 edited")
+        self.assertEqual(self.rendered()[:3], ["m0 edited", "m1|m1 more", "m2 edited"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+"""Strata network checks against loopback stand-ins, so they run offline"""
+import http.client
+import json
+import socket
+import threading
+import unittest
+
+from conftest import closed_port, load_script
+
+strata = load_script("Plunket&Strata.py")
+
+class LatencyProberTest(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(16)
+        self.open_target = f"127.0.0.1:{self.listener.getsockname()[1]}"
+        
+    def tearDown(self):
+        self.listener.close()
+        
+    def test_open_port_has_no_loss(self):
+        results = strata.LatencyProber([self.open_target], [], count=4, timeout=1.0, interval=0).measure_tcp()
+        summary = results[self.open_target]
+        self.assertEqual(summary["loss"], 0.0)
+        self.assertLessEqual(summary["min"], summary["avg"])
+        self.assertLessEqual(summary["avg"], summary["p95"])
+        
+    def test_closed_port_loses_everything(self):
+        target = f"127.0.0.1:{closed_port()}"
+        results = strata.LatencyProber([target, self.open_target], [], count=3, timeout=1.0, interval=0).measure_tcp()
+        self.assertEqual(results[target], {"loss": 100.0})
+        self.assertEqual(results[self.open_target]["loss"], 0.0)
+        
+    def test_ipv6_target_syntax(self):
+        self.assertEqual(strata.LatencyProber.parse_target("[::1]:53"), ("::1", 53))
+        
+    def test_summarize(self):
+        summary = strata.LatencyProber.summarize([0.010, None, 0.030, 0.020])
+        self.assertEqual(summary["loss"], 25.0)
+        self.assertAlmostEqual(summary["min"], 10.0)
+        self.assertAlmostEqual(summary["avg"], 20.0)
+        self.assertAlmostEqual(summary["p95"], 30.0)
+        self.assertAlmostEqual(summary["jitter"], 15.0)
+        self.assertEqual(strata.LatencyProber.summarize([]), {"loss": 100.0})
+        
+    def test_localhost_resolves(self):
+        results = strata.LatencyProber([], ["localhost"], timeout=2.0).measure_dns()
+        self.assertIsNotNone(results["localhost"])
+
+class SamplerWindowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = strata.StrataEngine(dict(strata.DEFAULT_CONFIG, strata_sample_rate=1.0, strata_history_seconds=600))
+        
+    def sample(self, seconds):
+        for i in range(seconds):
+            for name in strata.MetricsSampler.SERIES:
+                self.engine.sampler.buffers[name].append(float(i))
+        
+    def test_windows_cover_only_collected_history(self):
+        self.sample(45)
+        self.assertEqual(self.engine.windows(), [45])
+        finding = self.engine.describe("cpu", "cpu", "CPU", "%", strata.format_percent)
+        self.assertIn("(45s: min 0.0% / avg 22.0% / max 44.0%)", finding.text)
+        self.sample(225)
+        self.assertEqual(self.engine.windows(), [60, 270])
+        self.assertIn("; 4 min 30s: min", self.engine.describe("cpu", "cpu", "CPU", "%", strata.format_percent).text)
+        self.sample(400)
+        self.assertEqual(self.engine.windows(), [60, 600])
+        
+    def test_format_window(self):
+        self.assertEqual([strata.format_window(seconds) for seconds in (0.2, 45, 60, 270, 600)],
+                         ["1s", "45s", "1 min", "4 min 30s", "10 min"])
+
+class BandwidthTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = strata.BandwidthServer(("127.0.0.1", 0), strata.BandwidthHandler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        
+    def request(self, method, path, body=None):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=5)
+        try:
+            conn.request(method, path, body)
+            response = conn.getresponse()
+            return response.status, response.read()
+        finally:
+            conn.close()
+        
+    def test_endpoints(self):
+        self.assertEqual(self.request("GET", "/__down?bytes=100000"), (200, bytes(100000)))
+        status, body = self.request("POST", "/__up", bytes(70000))
+        self.assertEqual((status, json.loads(body)), (200, {"bytes": 70000}))
+        self.assertEqual(self.request("GET", "/elsewhere")[0], 404)
+        self.assertEqual(self.request("GET", "/__down?bytes=many")[0], 400)
+        
+    def test_round_trip(self):
+        probe = strata.BandwidthProbe(f"http://127.0.0.1:{self.port}", streams=2, seconds=1.0)
+        self.assertIsNotNone(probe.rtt())
+        for direction in ("download", "upload"):
+            rate, moved, rtts, errors = probe.measure(direction)
+            self.assertEqual(errors, [], direction)
+            self.assertGreater(moved, 0, direction)
+            self.assertGreater(rate, 0, direction)
+        
+    def test_unreachable(self):
+        self.assertIsNone(strata.BandwidthProbe(f"http://127.0.0.1:{closed_port()}").rtt())
+
+if __name__ == "__main__":
+    unittest.main()